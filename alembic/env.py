@@ -44,6 +44,9 @@ def run_migrations_online() -> None:
     """Run migrations in 'online' mode."""
     configuration = config.get_section(config.config_ini_section)
     configuration["sqlalchemy.url"] = get_url()
+    # executemany в миграциях (например, заполнение таблиц-маппингов)
+    # отправляется пачками через psycopg2 execute_batch, а не по одной строке
+    configuration.setdefault("sqlalchemy.executemany_mode", "values_plus_batch")
     
     connectable = engine_from_config(
         configuration,
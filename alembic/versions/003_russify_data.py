@@ -52,45 +52,75 @@ PROPERTY_TYPE_MAPPING = {
     "kommercheskuyu-nedvizhimost": "Коммерческая недвижимость",
 }
 
+# Размер пачки по id: каждая пачка коммитится отдельно, чтобы не держать
+# блокировки на всю таблицу и не раздувать одну транзакцию
+BATCH_SIZE = 5000
 
-def upgrade() -> None:
-    """Обновляем существующие данные - заменяем транслит на русские названия"""
-    connection = op.get_bind()
+
+def _remap_column(connection, table: str, column: str, mapping: dict) -> None:
+    """Заменяет значения колонки по маппингу через UPDATE ... FROM пачками по id"""
+    if not mapping:
+        return
     
-    # Обновляем города в listings
-    for slug, name in CITY_MAPPING.items():
-        connection.execute(
-            sa.text("UPDATE listings SET city = :name WHERE city = :slug"),
-            {"name": name, "slug": slug}
+    # Оставляем только значения, которые реально есть в таблице -
+    # на уже обновленной базе миграция ничего не перезаписывает
+    present = {
+        row[0] for row in connection.execute(
+            sa.text(f"SELECT DISTINCT {column} FROM {table} WHERE {column} = ANY(:values)"),
+            {"values": list(mapping)}
         )
+    }
+    mapping = {old: new for old, new in mapping.items() if old in present}
+    if not mapping:
+        return
     
-    # Обновляем города в properties
-    for slug, name in CITY_MAPPING.items():
-        connection.execute(
-            sa.text("UPDATE properties SET city = :name WHERE city = :slug"),
-            {"name": name, "slug": slug}
-        )
+    # Маппинг кладем во временную UNLOGGED таблицу, чтобы планировщик
+    # мог выбрать hash join, а сама таблица не писала WAL
+    connection.execute(sa.text("DROP TABLE IF EXISTS _remap_map"))
+    connection.execute(sa.text("CREATE UNLOGGED TABLE _remap_map (slug text PRIMARY KEY, name text NOT NULL)"))
+    connection.execute(
+        sa.text("INSERT INTO _remap_map (slug, name) VALUES (:slug, :name)"),
+        [{"slug": old, "name": new} for old, new in mapping.items()]
+    )
     
-    # Обновляем типы сделок в listings
-    for slug, name in DEAL_TYPE_MAPPING.items():
-        connection.execute(
-            sa.text("UPDATE listings SET deal_type = :name WHERE deal_type = :slug"),
-            {"name": name, "slug": slug}
-        )
+    # Запрос разбирается и планируется один раз, пачки выполняются через EXECUTE.
+    # Подготовленный запрос живет в сессии и переживает коммиты autocommit_block
+    connection.execute(sa.text(
+        f"PREPARE _remap_batch(bigint, bigint) AS "
+        f"UPDATE {table} SET {column} = m.name FROM _remap_map m "
+        f"WHERE {table}.{column} = m.slug AND {table}.id >= $1 AND {table}.id < $2"
+    ))
     
-    # Обновляем типы недвижимости в listings
-    for slug, name in PROPERTY_TYPE_MAPPING.items():
-        connection.execute(
-            sa.text("UPDATE listings SET property_type = :name WHERE property_type = :slug"),
-            {"name": name, "slug": slug}
-        )
+    max_id = connection.execute(sa.text(f"SELECT MAX(id) FROM {table}")).scalar()
+    if max_id is not None:
+        for lo in range(0, max_id + 1, BATCH_SIZE):
+            with op.get_context().autocommit_block():
+                connection.execute(
+                    sa.text("EXECUTE _remap_batch(:lo, :hi)"),
+                    {"lo": lo, "hi": lo + BATCH_SIZE}
+                )
     
-    # Обновляем типы недвижимости в properties
-    for slug, name in PROPERTY_TYPE_MAPPING.items():
-        connection.execute(
-            sa.text("UPDATE properties SET property_type = :name WHERE property_type = :slug"),
-            {"name": name, "slug": slug}
-        )
+    connection.execute(sa.text("DEALLOCATE _remap_batch"))
+    connection.execute(sa.text("DROP TABLE _remap_map"))
+
+
+def upgrade() -> None:
+    """Обновляем существующие данные - заменяем транслит на русские названия"""
+    connection = op.get_bind()
+    
+    # В 001 нет индекса на listings.property_type - создаем временный на время миграции
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS tmp_ix_listings_ptype ON listings (property_type)")
+    
+    # Одно UPDATE на пару (таблица, колонка) вместо UPDATE на каждый slug
+    _remap_column(connection, "listings", "city", CITY_MAPPING)
+    _remap_column(connection, "properties", "city", CITY_MAPPING)
+    _remap_column(connection, "listings", "deal_type", DEAL_TYPE_MAPPING)
+    _remap_column(connection, "listings", "property_type", PROPERTY_TYPE_MAPPING)
+    _remap_column(connection, "properties", "property_type", PROPERTY_TYPE_MAPPING)
+    
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS tmp_ix_listings_ptype")
 
 
 def downgrade() -> None:
@@ -103,28 +133,8 @@ def downgrade() -> None:
     PROPERTY_TYPE_REVERSE = {v: k for k, v in PROPERTY_TYPE_MAPPING.items() if k not in ["kvartiru", "komnatu", "dom", "uchastok", "kommercheskuyu-nedvizhimost"]}
     
     # Откатываем изменения
-    for name, slug in CITY_REVERSE.items():
-        connection.execute(
-            sa.text("UPDATE listings SET city = :slug WHERE city = :name"),
-            {"slug": slug, "name": name}
-        )
-        connection.execute(
-            sa.text("UPDATE properties SET city = :slug WHERE city = :name"),
-            {"slug": slug, "name": name}
-        )
-    
-    for name, slug in DEAL_TYPE_REVERSE.items():
-        connection.execute(
-            sa.text("UPDATE listings SET deal_type = :slug WHERE deal_type = :name"),
-            {"slug": slug, "name": name}
-        )
-    
-    for name, slug in PROPERTY_TYPE_REVERSE.items():
-        connection.execute(
-            sa.text("UPDATE listings SET property_type = :slug WHERE property_type = :name"),
-            {"slug": slug, "name": name}
-        )
-        connection.execute(
-            sa.text("UPDATE properties SET property_type = :slug WHERE property_type = :name"),
-            {"slug": slug, "name": name}
-        )
+    _remap_column(connection, "listings", "city", CITY_REVERSE)
+    _remap_column(connection, "properties", "city", CITY_REVERSE)
+    _remap_column(connection, "listings", "deal_type", DEAL_TYPE_REVERSE)
+    _remap_column(connection, "listings", "property_type", PROPERTY_TYPE_REVERSE)
+    _remap_column(connection, "properties", "property_type", PROPERTY_TYPE_REVERSE)
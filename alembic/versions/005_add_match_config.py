@@ -29,8 +29,8 @@ def upgrade() -> None:
             'match_configs',
             sa.Column('id', sa.Integer(), nullable=False),
             sa.Column('is_active', sa.Boolean(), nullable=False, server_default='true'),
-            sa.Column('weights', postgresql.JSON(astext_type=sa.Text()), nullable=False),
-            sa.Column('strict_attributes', postgresql.JSON(astext_type=sa.Text()), nullable=False),
+            sa.Column('weights', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+            sa.Column('strict_attributes', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
             sa.Column('threshold', sa.String(length=10), nullable=False, server_default='70.0'),
             sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
             sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
@@ -48,8 +48,8 @@ def upgrade() -> None:
             INSERT INTO match_configs (is_active, weights, strict_attributes, threshold)
             VALUES (
                 true,
-                '{"city": 15.0, "street": 20.0, "house_number": 15.0, "rooms": 10.0, "area_total": 15.0, "floor": 5.0, "property_type": 10.0, "district": 5.0, "area_living": 3.0, "area_kitchen": 2.0}'::json,
-                '["city", "street", "house_number"]'::json,
+                '{"city": 15.0, "street": 20.0, "house_number": 15.0, "rooms": 10.0, "area_total": 15.0, "floor": 5.0, "property_type": 10.0, "district": 5.0, "area_living": 3.0, "area_kitchen": 2.0}'::jsonb,
+                '["city", "street", "house_number"]'::jsonb,
                 '70.0'
             )
         """)
@@ -0,0 +1,40 @@
+"""Change match_configs.threshold to float
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column('match_configs', 'threshold', server_default=None)
+    op.alter_column(
+        'match_configs', 'threshold',
+        existing_type=sa.String(length=10),
+        type_=sa.Float(),
+        existing_nullable=False,
+        postgresql_using='threshold::double precision',
+    )
+    op.alter_column('match_configs', 'threshold', server_default='70.0')
+
+
+def downgrade() -> None:
+    op.alter_column('match_configs', 'threshold', server_default=None)
+    op.alter_column(
+        'match_configs', 'threshold',
+        existing_type=sa.Float(),
+        type_=sa.String(length=10),
+        existing_nullable=False,
+        postgresql_using='threshold::varchar(10)',
+    )
+    op.alter_column('match_configs', 'threshold', server_default='70.0')
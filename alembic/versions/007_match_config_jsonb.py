@@ -0,0 +1,38 @@
+"""Convert match_configs JSON columns to JSONB
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Для баз, где 005 уже применена с JSON
+    for column in ('weights', 'strict_attributes'):
+        op.alter_column(
+            'match_configs', column,
+            type_=postgresql.JSONB(astext_type=sa.Text()),
+            existing_nullable=False,
+            postgresql_using=f'{column}::jsonb',
+        )
+
+
+def downgrade() -> None:
+    for column in ('weights', 'strict_attributes'):
+        op.alter_column(
+            'match_configs', column,
+            type_=postgresql.JSON(astext_type=sa.Text()),
+            existing_nullable=False,
+            postgresql_using=f'{column}::json',
+        )
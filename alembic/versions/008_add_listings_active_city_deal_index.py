@@ -0,0 +1,50 @@
+"""Add partial composite index on listings (is_active, city, deal_type)
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_listings_active_city_deal',
+            'listings',
+            ['is_active', 'city', 'deal_type'],
+            unique=False,
+            postgresql_where=sa.text('is_active = true'),
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            op.f('ix_listings_is_active'),
+            table_name='listings',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_listings_is_active'),
+            'listings',
+            ['is_active'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_listings_active_city_deal',
+            table_name='listings',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,37 @@
+"""Add partial index on listings.match_score
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_listings_match_score',
+            'listings',
+            [sa.text('match_score DESC NULLS LAST')],
+            unique=False,
+            postgresql_where=sa.text('property_id IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_listings_match_score',
+            table_name='listings',
+            postgresql_concurrently=True,
+        )
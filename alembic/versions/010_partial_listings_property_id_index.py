@@ -0,0 +1,42 @@
+"""Replace listings.property_id index with a partial one
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Несопоставленные объявления (property_id IS NULL) в индекс не попадают,
+    # а проверка FK при удалении объекта недвижимости остается индексной
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_property_id_notnull "
+            "ON listings (property_id) WHERE property_id IS NOT NULL"
+        )
+        op.drop_index(
+            op.f('ix_listings_property_id'),
+            table_name='listings',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_listings_property_id'),
+            'listings',
+            ['property_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_listings_property_id_notnull")
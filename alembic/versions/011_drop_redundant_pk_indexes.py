@@ -0,0 +1,28 @@
+"""Drop redundant indexes on primary key columns
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+# Первичные ключи уже покрыты уникальным индексом PK
+TABLES = ['properties', 'listings', 'status_logs', 'match_configs']
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.drop_index(op.f(f'ix_{table}_id'), table_name=table)
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.create_index(op.f(f'ix_{table}_id'), table, ['id'], unique=False)
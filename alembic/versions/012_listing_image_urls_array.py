@@ -0,0 +1,63 @@
+"""Replace listings.images text blob with image_urls array
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def _backfill(sql: str) -> None:
+    """Выполняет UPDATE пачками по id, коммитя каждую пачку"""
+    connection = op.get_bind()
+    max_id = connection.execute(sa.text("SELECT MAX(id) FROM listings")).scalar()
+    if max_id is None:
+        return
+    
+    for lo in range(0, max_id + 1, BATCH_SIZE):
+        with op.get_context().autocommit_block():
+            connection.execute(sa.text(sql), {"lo": lo, "hi": lo + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    # Пачки бэкфилла коммитятся по ходу: если миграция прервется, колонка уже будет в базе,
+    # а alembic_version - нет. IF NOT EXISTS позволяет просто запустить ее повторно
+    op.execute("ALTER TABLE listings ADD COLUMN IF NOT EXISTS image_urls varchar(500)[]")
+    
+    # images хранил JSON-массив URL; остальное содержимое не переносим. Битый JSON
+    # дает NULL вместо ошибки посреди бэкфилла, слишком длинные URL обрезаются под varchar(500)
+    op.execute(
+        "CREATE OR REPLACE FUNCTION pg_temp.images_to_urls(images text) RETURNS varchar(500)[] AS $$ "
+        "BEGIN "
+        "RETURN ARRAY(SELECT LEFT(value, 500) FROM json_array_elements_text(images::json) AS value); "
+        "EXCEPTION WHEN others THEN RETURN NULL; "
+        "END $$ LANGUAGE plpgsql"
+    )
+    _backfill(
+        "UPDATE listings SET image_urls = pg_temp.images_to_urls(images) "
+        "WHERE images LIKE '[%' AND id >= :lo AND id < :hi"
+    )
+    
+    op.drop_column('listings', 'images')
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE listings ADD COLUMN IF NOT EXISTS images text")
+    
+    _backfill(
+        "UPDATE listings SET images = array_to_json(image_urls)::text "
+        "WHERE image_urls IS NOT NULL AND id >= :lo AND id < :hi"
+    )
+    
+    op.drop_column('listings', 'image_urls')
@@ -0,0 +1,36 @@
+"""Add (parsed_at DESC, id DESC) index for keyset pagination of listings
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_listings_parsed_at_id',
+            'listings',
+            [sa.text('parsed_at DESC'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_listings_parsed_at_id',
+            table_name='listings',
+            postgresql_concurrently=True,
+        )
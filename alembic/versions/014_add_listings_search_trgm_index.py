@@ -0,0 +1,32 @@
+"""Add trigram GIN index for listings text search
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+# Выражение должно совпадать с LISTING_SEARCH_EXPRESSION в app/models/listing.py
+SEARCH_EXPRESSION = "coalesce(title, '') || ' ' || coalesce(address, '') || ' ' || coalesce(description, '')"
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_search_trgm "
+            f"ON listings USING gin (({SEARCH_EXPRESSION}) gin_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_listings_search_trgm")
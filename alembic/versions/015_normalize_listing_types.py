@@ -0,0 +1,61 @@
+"""Normalize listings deal_type/property_type to canonical Russian names
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '015'
+down_revision = '014'
+branch_labels = None
+depends_on = None
+
+# Каноническое название -> slug'и, которые могли попасть в базу до нормализации
+DEAL_TYPE_SLUGS = {
+    "Продажа": ["sale", "prodam", "kupit"],
+    "Аренда": ["rent", "sdam", "snyat"],
+}
+
+PROPERTY_TYPE_SLUGS = {
+    "Квартиры": ["kvartiry", "kvartiru"],
+    "Комнаты": ["komnaty", "komnatu"],
+    "Дома": ["doma", "dom"],
+    "Участки": ["uchastki", "uchastok"],
+    "Коммерческая недвижимость": ["kommercheskaya", "kommercheskuyu-nedvizhimost"],
+}
+
+BATCH_SIZE = 5000
+
+
+def _normalize(table: str, column: str, slugs_by_name: dict) -> None:
+    """Заменяет slug'и каноническими названиями пачками по id"""
+    connection = op.get_bind()
+    max_id = connection.execute(sa.text(f"SELECT MAX(id) FROM {table}")).scalar()
+    if max_id is None:
+        return
+    
+    sql = sa.text(
+        f"UPDATE {table} SET {column} = :name "
+        f"WHERE {column} = ANY(:slugs) AND id >= :lo AND id < :hi"
+    )
+    for lo in range(0, max_id + 1, BATCH_SIZE):
+        with op.get_context().autocommit_block():
+            for name, slugs in slugs_by_name.items():
+                connection.execute(sql, {"name": name, "slugs": slugs, "lo": lo, "hi": lo + BATCH_SIZE})
+
+
+def upgrade() -> None:
+    # Повторный запуск ничего не меняет - канонические значения под условие не попадают
+    _normalize("listings", "deal_type", DEAL_TYPE_SLUGS)
+    _normalize("listings", "property_type", PROPERTY_TYPE_SLUGS)
+    _normalize("properties", "property_type", PROPERTY_TYPE_SLUGS)
+
+
+def downgrade() -> None:
+    # Исходные slug'и не сохранялись; канонические названия понимает и старый код
+    pass
@@ -0,0 +1,36 @@
+"""Add (created_at DESC, id DESC) index for keyset pagination of properties
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '016'
+down_revision = '015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_properties_created_at_id',
+            'properties',
+            [sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_properties_created_at_id',
+            table_name='properties',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,79 @@
+"""Add composite indexes for property list filters and listing price aggregates
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '017'
+down_revision = '016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Фильтр по городу/типу + сортировка по дате идут по индексу до LIMIT без сортировки.
+    # Одноколоночные индексы - префиксы новых, поэтому удаляются
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_properties_city_created_at_id',
+            'properties',
+            ['city', sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_properties_property_type_created_at_id',
+            'properties',
+            ['property_type', sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        # MIN/MAX(price) по объекту читаются из индекса; заменяет частичный индекс по property_id
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_property_id_price "
+            "ON listings (property_id, price) WHERE property_id IS NOT NULL"
+        )
+        
+        op.drop_index(op.f('ix_properties_city'), table_name='properties', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_properties_property_type'), table_name='properties', postgresql_concurrently=True)
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_listings_property_id_notnull")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listings_property_id_notnull "
+            "ON listings (property_id) WHERE property_id IS NOT NULL"
+        )
+        op.create_index(
+            op.f('ix_properties_property_type'),
+            'properties',
+            ['property_type'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            op.f('ix_properties_city'),
+            'properties',
+            ['city'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_listings_property_id_price")
+        op.drop_index(
+            'ix_properties_property_type_created_at_id',
+            table_name='properties',
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_properties_city_created_at_id',
+            table_name='properties',
+            postgresql_concurrently=True,
+        )
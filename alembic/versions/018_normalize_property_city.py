@@ -0,0 +1,60 @@
+"""Normalize properties.city to canonical Russian names
+
+Revision ID: 018
+Revises: 017
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '018'
+down_revision = '017'
+branch_labels = None
+depends_on = None
+
+# Каноническое название -> slug'и, которые могли попасть в базу до нормализации.
+# Кроме них сравнение идет с названием в нижнем регистре (так писал PropertyMatcher)
+CITY_SLUGS = {
+    "Санкт-Петербург": ["spb", "sankt-peterburg"],
+    "Москва": ["moskva"],
+    "Екатеринбург": ["ekaterinburg"],
+    "Новосибирск": ["novosibirsk"],
+    "Казань": ["kazan"],
+    "Нижний Новгород": ["nizhny-novgorod"],
+    "Челябинск": ["chelyabinsk"],
+    "Самара": ["samara"],
+    "Ростов-на-Дону": ["rostov-na-donu"],
+    "Уфа": ["ufa"],
+}
+
+BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    # properties.property_type нормализован в 015; повторный запуск ничего не меняет
+    connection = op.get_bind()
+    max_id = connection.execute(sa.text("SELECT MAX(id) FROM properties")).scalar()
+    if max_id is None:
+        return
+    
+    sql = sa.text(
+        "UPDATE properties SET city = :name "
+        "WHERE lower(btrim(city)) = ANY(:variants) AND city <> :name AND id >= :lo AND id < :hi"
+    )
+    for lo in range(0, max_id + 1, BATCH_SIZE):
+        with op.get_context().autocommit_block():
+            for name, slugs in CITY_SLUGS.items():
+                connection.execute(sql, {
+                    "name": name,
+                    "variants": slugs + [name.lower()],
+                    "lo": lo,
+                    "hi": lo + BATCH_SIZE,
+                })
+
+
+def downgrade() -> None:
+    # Исходные slug'и не сохранялись; канонические названия понимает и старый код
+    pass
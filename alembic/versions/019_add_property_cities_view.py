@@ -0,0 +1,29 @@
+"""Add property_cities materialized view for the city list
+
+Revision ID: 019
+Revises: 018
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '019'
+down_revision = '018'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE MATERIALIZED VIEW property_cities AS "
+        "SELECT city, COUNT(*) AS cnt FROM properties "
+        "WHERE city IS NOT NULL GROUP BY city"
+    )
+    # Уникальный индекс нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+    op.execute("CREATE UNIQUE INDEX ix_property_cities_city ON property_cities (city)")
+
+
+def downgrade() -> None:
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS property_cities")
@@ -1,6 +1,21 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from functools import lru_cache
-from typing import Dict, List
+from typing import Dict, FrozenSet
+
+# Веса атрибутов по умолчанию для вычисления сходства (сумма должна быть ~100)
+_DEFAULT_MATCH_WEIGHTS = (
+    ("city", 15.0),
+    ("street", 20.0),
+    ("house_number", 15.0),
+    ("rooms", 10.0),
+    ("area_total", 15.0),
+    ("floor", 5.0),
+    ("property_type", 10.0),
+    ("district", 5.0),
+    ("area_living", 3.0),
+    ("area_kitchen", 2.0),
+)
 
 
 class Settings(BaseSettings):
@@ -15,25 +30,16 @@ class Settings(BaseSettings):
     
     # Настройки метчинга недвижимости
     # Веса атрибутов для вычисления сходства (сумма должна быть ~100)
-    property_match_weights: Dict[str, float] = {
-        "city": 15.0,
-        "street": 20.0,
-        "house_number": 15.0,
-        "rooms": 10.0,
-        "area_total": 15.0,
-        "floor": 5.0,
-        "property_type": 10.0,
-        "district": 5.0,
-        "area_living": 3.0,
-        "area_kitchen": 2.0,
-    }
+    property_match_weights: Dict[str, float] = Field(
+        default_factory=lambda: dict(_DEFAULT_MATCH_WEIGHTS)
+    )
     
     # Атрибуты, которые должны строго совпадать (иначе сходство = 0)
-    property_match_strict_attributes: List[str] = [
+    property_match_strict_attributes: FrozenSet[str] = frozenset({
         "city",
         "street",
         "house_number",
-    ]
+    })
     
     # Минимальный процент сходства для сопоставления (0-100)
     property_match_threshold: float = 70.0
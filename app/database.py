@@ -4,7 +4,10 @@ from app.config import get_settings
 
 settings = get_settings()
 
-engine = create_engine(settings.database_url)
+# Кэш скомпилированных запросов: фильтры списков необязательны, и каждое их сочетание
+# дает свою форму SQL (значения уходят в параметры). Стандартных 500 форм на все
+# эндпоинты не хватает, и запросы вытесняют друг друга с повторной компиляцией
+engine = create_engine(settings.database_url, query_cache_size=2000)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
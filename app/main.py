@@ -1,14 +1,18 @@
+import time
 import logging
+from contextlib import asynccontextmanager
+
+import httpx
 from fastapi import FastAPI, Request, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from app.config import get_settings
-from app.database import engine, Base, get_db
+from app.database import get_db
 from app.routers import listings_router, properties_router, parser_router, admin_router
-from app.models import Listing, Property
 
 settings = get_settings()
 
@@ -21,9 +25,27 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Общий асинхронный HTTP-клиент с пулом соединений на время жизни приложения"""
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        follow_redirects=True,
+        limits=httpx.Limits(max_keepalive_connections=20),
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+
+
+# JSON-ответы API кодируются orjson (C) вместо стандартного json
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     title=settings.app_name,
     description="Система парсинга и анализа объявлений недвижимости с Avito",
     version="1.0.0"
@@ -36,13 +58,37 @@ app.include_router(admin_router)
 
 templates = Jinja2Templates(directory="app/templates")
 
+# Кэш счетчиков дашборда: (время вычисления, (всего, активных, объектов))
+DASHBOARD_COUNTS_TTL = 60.0
+_dashboard_counts_cache = {"computed_at": 0.0, "counts": None}
+
+
+def _get_dashboard_counts(db: Session):
+    """Возвращает счетчики дашборда одним запросом с кэшированием на TTL"""
+    now = time.monotonic()
+    if (
+        _dashboard_counts_cache["counts"] is not None
+        and now - _dashboard_counts_cache["computed_at"] < DASHBOARD_COUNTS_TTL
+    ):
+        return _dashboard_counts_cache["counts"]
+    
+    row = db.execute(text(
+        "SELECT "
+        "(SELECT count(*) FROM listings) AS listings_count, "
+        "(SELECT count(*) FROM listings WHERE is_active) AS active_listings, "
+        "(SELECT count(*) FROM properties) AS properties_count"
+    )).one()
+    
+    counts = (row.listings_count, row.active_listings, row.properties_count)
+    _dashboard_counts_cache["counts"] = counts
+    _dashboard_counts_cache["computed_at"] = now
+    return counts
+
 
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request, db: Session = Depends(get_db)):
+def index(request: Request, db: Session = Depends(get_db)):
     """Главная страница - дашборд"""
-    listings_count = db.query(Listing).count()
-    active_listings = db.query(Listing).filter(Listing.is_active == True).count()
-    properties_count = db.query(Property).count()
+    listings_count, active_listings, properties_count = _get_dashboard_counts(db)
     
     return templates.TemplateResponse("index.html", {
         "request": request,
@@ -53,13 +99,13 @@ async def index(request: Request, db: Session = Depends(get_db)):
 
 
 @app.get("/listings", response_class=HTMLResponse)
-async def listings_page(request: Request):
+def listings_page(request: Request):
     """Страница объявлений"""
     return templates.TemplateResponse("listings.html", {"request": request})
 
 
 @app.get("/listings/{listing_id}", response_class=HTMLResponse)
-async def listing_detail_page(request: Request, listing_id: int):
+def listing_detail_page(request: Request, listing_id: int):
     """Страница детального просмотра объявления"""
     return templates.TemplateResponse("listing_detail.html", {
         "request": request,
@@ -68,13 +114,13 @@ async def listing_detail_page(request: Request, listing_id: int):
 
 
 @app.get("/properties", response_class=HTMLResponse)
-async def properties_page(request: Request):
+def properties_page(request: Request):
     """Страница объектов недвижимости"""
     return templates.TemplateResponse("properties.html", {"request": request})
 
 
 @app.get("/properties/{property_id}", response_class=HTMLResponse)
-async def property_detail_page(request: Request, property_id: int):
+def property_detail_page(request: Request, property_id: int):
     """Страница детального просмотра объекта"""
     return templates.TemplateResponse("property_detail.html", {
         "request": request,
@@ -83,13 +129,13 @@ async def property_detail_page(request: Request, property_id: int):
 
 
 @app.get("/parser", response_class=HTMLResponse)
-async def parser_page(request: Request):
+def parser_page(request: Request):
     """Страница управления парсингом"""
     return templates.TemplateResponse("parser.html", {"request": request})
 
 
 @app.get("/admin/match-config", response_class=HTMLResponse)
-async def match_config_page(request: Request):
+def match_config_page(request: Request):
     """Страница настройки метчинга"""
     return templates.TemplateResponse("match_config.html", {"request": request})
 
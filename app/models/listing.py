@@ -1,18 +1,59 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean, BigInteger
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean, BigInteger, Index, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from app.database import Base
 
+# Текст для поиска по объявлению; по этому выражению построен trigram-индекс
+# ix_listings_search_trgm (миграция 014), поэтому менять его нужно вместе с индексом
+LISTING_SEARCH_EXPRESSION = "coalesce(title, '') || ' ' || coalesce(address, '') || ' ' || coalesce(description, '')"
+
+# Slug'и Cian -> канонические названия, которые хранятся в базе (см. миграцию 015)
+DEAL_TYPE_SLUG_TO_NAME = {
+    "sale": "Продажа",
+    "rent": "Аренда",
+    "prodam": "Продажа",
+    "sdam": "Аренда",
+    "kupit": "Продажа",
+    "snyat": "Аренда",
+}
+
+PROPERTY_TYPE_SLUG_TO_NAME = {
+    "kvartiry": "Квартиры",
+    "kvartiru": "Квартиры",
+    "komnaty": "Комнаты",
+    "komnatu": "Комнаты",
+    "doma": "Дома",
+    "dom": "Дома",
+    "uchastki": "Участки",
+    "uchastok": "Участки",
+    "kommercheskaya": "Коммерческая недвижимость",
+    "kommercheskuyu-nedvizhimost": "Коммерческая недвижимость",
+}
+
+
 
 class Listing(Base):
     """
     Объявление о продаже/аренде недвижимости
     """
     __tablename__ = "listings"
+    __table_args__ = (
+        Index(
+            "ix_listings_active_city_deal",
+            "is_active", "city", "deal_type",
+            postgresql_where=text("is_active = true"),
+        ),
+        Index(
+            "ix_listings_property_id_price",
+            "property_id", "price",
+            postgresql_where=text("property_id IS NOT NULL"),
+        ),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     avito_id = Column(BigInteger, unique=True, index=True, nullable=False)
-    property_id = Column(Integer, ForeignKey("properties.id"), nullable=True, index=True)
+    property_id = Column(Integer, ForeignKey("properties.id"), nullable=True)
     match_score = Column(Float, nullable=True, comment="Процент сходства с объектом недвижимости (0-100)")
     
     title = Column(String(500), nullable=True)
@@ -49,9 +90,9 @@ class Listing(Base):
     seller_name = Column(String(255), nullable=True)
     seller_type = Column(String(50), nullable=True)
     
-    images = Column(Text, nullable=True)
+    image_urls = Column(ARRAY(String(500)), nullable=True)
     
-    is_active = Column(Boolean, default=True, index=True)
+    is_active = Column(Boolean, default=True)
     
     parsed_at = Column(DateTime(timezone=True), server_default=func.now())
     published_at = Column(DateTime(timezone=True), nullable=True)
@@ -60,5 +101,28 @@ class Listing(Base):
     property = relationship("Property", back_populates="listings")
     status_logs = relationship("StatusLog", back_populates="listing", cascade="all, delete-orphan")
     
+    @validates("deal_type")
+    def _normalize_deal_type(self, key, value):
+        """Сохраняем только каноническое название типа сделки"""
+        return DEAL_TYPE_SLUG_TO_NAME.get(value, value)
+    
+    @validates("property_type")
+    def _normalize_property_type(self, key, value):
+        """Сохраняем только каноническое название типа недвижимости"""
+        return PROPERTY_TYPE_SLUG_TO_NAME.get(value, value)
+    
     def __repr__(self):
         return f"<Listing(id={self.id}, avito_id={self.avito_id}, title={self.title[:50] if self.title else None})>"
+
+
+Index(
+    "ix_listings_match_score",
+    Listing.match_score.desc().nullslast(),
+    postgresql_where=Listing.property_id.isnot(None),
+)
+
+Index(
+    "ix_listings_parsed_at_id",
+    Listing.parsed_at.desc(),
+    Listing.id.desc(),
+)
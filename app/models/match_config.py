@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime, Boolean
+from sqlalchemy import Column, Integer, Float, DateTime, Boolean
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -10,17 +11,17 @@ class MatchConfig(Base):
     """
     __tablename__ = "match_configs"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     is_active = Column(Boolean, default=True, nullable=False, comment="Активна ли эта конфигурация")
     
     # Веса атрибутов в формате JSON: {"city": 15.0, "street": 20.0, ...}
-    weights = Column(JSON, nullable=False, comment="Веса атрибутов для вычисления сходства")
+    weights = Column(JSONB, nullable=False, comment="Веса атрибутов для вычисления сходства")
     
     # Список строгих атрибутов: ["city", "street", "house_number"]
-    strict_attributes = Column(JSON, nullable=False, comment="Атрибуты, которые должны строго совпадать")
+    strict_attributes = Column(JSONB, nullable=False, comment="Атрибуты, которые должны строго совпадать")
     
     # Минимальный процент сходства для сопоставления
-    threshold = Column(String(10), nullable=False, default="70.0", comment="Минимальный процент сходства (0-100)")
+    threshold = Column(Float, nullable=False, default=70.0, comment="Минимальный процент сходства (0-100)")
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,7 +1,29 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Index
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from app.database import Base
+from app.models.listing import PROPERTY_TYPE_SLUG_TO_NAME
+
+# Slug'и городов Cian -> канонические названия, которые хранятся в базе (см. миграцию 018)
+CITY_SLUG_TO_NAME = {
+    "spb": "Санкт-Петербург",
+    "sankt-peterburg": "Санкт-Петербург",
+    "moskva": "Москва",
+    "ekaterinburg": "Екатеринбург",
+    "novosibirsk": "Новосибирск",
+    "kazan": "Казань",
+    "nizhny-novgorod": "Нижний Новгород",
+    "chelyabinsk": "Челябинск",
+    "samara": "Самара",
+    "rostov-na-donu": "Ростов-на-Дону",
+    "ufa": "Уфа",
+}
+
+# Поиск канонического названия без учета регистра: по slug'у или по самому названию
+_CITY_LOOKUP = {
+    **CITY_SLUG_TO_NAME,
+    **{name.lower(): name for name in CITY_SLUG_TO_NAME.values()},
+}
 
 
 class Property(Base):
@@ -11,14 +33,14 @@ class Property(Base):
     """
     __tablename__ = "properties"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
-    city = Column(String(255), nullable=True, index=True)
+    city = Column(String(255), nullable=True)
     district = Column(String(255), nullable=True)
     street = Column(String(255), nullable=True)
     house_number = Column(String(50), nullable=True)
     
-    property_type = Column(String(50), nullable=True, index=True)
+    property_type = Column(String(50), nullable=True)
     rooms = Column(Integer, nullable=True)
     floor = Column(Integer, nullable=True)
     floors_total = Column(Integer, nullable=True)
@@ -33,5 +55,38 @@ class Property(Base):
     
     listings = relationship("Listing", back_populates="property")
     
+    @validates("city")
+    def _normalize_city(self, key, value):
+        """Сохраняем только каноническое название города"""
+        if not value:
+            return value
+        return _CITY_LOOKUP.get(value.strip().lower(), value)
+    
+    @validates("property_type")
+    def _normalize_property_type(self, key, value):
+        """Сохраняем только каноническое название типа недвижимости"""
+        return PROPERTY_TYPE_SLUG_TO_NAME.get(value, value)
+    
     def __repr__(self):
         return f"<Property(id={self.id}, city={self.city}, street={self.street}, rooms={self.rooms})>"
+
+
+Index(
+    "ix_properties_created_at_id",
+    Property.created_at.desc(),
+    Property.id.desc(),
+)
+
+Index(
+    "ix_properties_city_created_at_id",
+    Property.city,
+    Property.created_at.desc(),
+    Property.id.desc(),
+)
+
+Index(
+    "ix_properties_property_type_created_at_id",
+    Property.property_type,
+    Property.created_at.desc(),
+    Property.id.desc(),
+)
@@ -11,7 +11,7 @@ class StatusLog(Base):
     """
     __tablename__ = "status_logs"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
     # Связь с объявлением
     listing_id = Column(Integer, ForeignKey("listings.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -21,8 +21,8 @@ def get_match_config(db: Session = Depends(get_db)):
         config = MatchConfig(
             is_active=True,
             weights=settings.property_match_weights,
-            strict_attributes=settings.property_match_strict_attributes,
-            threshold=str(settings.property_match_threshold)
+            strict_attributes=sorted(settings.property_match_strict_attributes),
+            threshold=settings.property_match_threshold
         )
         db.add(config)
         db.commit()
@@ -48,7 +48,7 @@ def create_match_config(config_data: MatchConfigCreate, db: Session = Depends(ge
         is_active=config_data.is_active,
         weights=config_data.weights,
         strict_attributes=config_data.strict_attributes,
-        threshold=str(config_data.threshold)
+        threshold=config_data.threshold
     )
     
     db.add(config)
@@ -78,10 +78,7 @@ def update_match_config(
         ).update({"is_active": False})
     
     for key, value in update_data.items():
-        if key == 'threshold' and value is not None:
-            setattr(config, key, str(value))
-        else:
-            setattr(config, key, value)
+        setattr(config, key, value)
     
     db.commit()
     db.refresh(config)
@@ -1,41 +1,85 @@
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+import json
+from typing import Literal, Optional, Tuple
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session, selectinload, raiseload, load_only
+from sqlalchemy import tuple_, func, case, text, update
 
 from app.database import get_db
 from app.models import Listing
-from app.schemas.listing import ListingResponse, ListingListResponse, ListingUpdate
+from app.models.listing import LISTING_SEARCH_EXPRESSION, DEAL_TYPE_SLUG_TO_NAME, PROPERTY_TYPE_SLUG_TO_NAME
+from app.schemas.listing import ListingResponse, ListingCardResponse, ListingListResponse, ListingUpdate
 from app.services.cian_parser import CianParser
 from app.services.listing_scorer import ListingScorer  # Старый сервис (для обратной совместимости)
 from app.services.property_matcher import PropertyMatcher
 from app.services.scoring import SaleProbabilityScorer, RegionalStatistics
+from app.services.cache import response_cache
+from app.services.pagination import encode_cursor, decode_cursor
 
-DEAL_TYPE_SLUG_TO_NAME = {
-    "sale": "Продажа",
-    "rent": "Аренда",
-    "prodam": "Продажа",
-    "sdam": "Аренда",
-    "kupit": "Продажа",
-    "snyat": "Аренда",
+# Поля детальной страницы, которые переносятся в объявление
+PARSEABLE_FIELDS = frozenset({
+    'price', 'rooms', 'floor', 'floors_total',
+    'area_total', 'area_living', 'area_kitchen',
+    'address', 'description', 'title',
+    'metro', 'metro_time', 'metro_transport',
+})
+
+# Список отдает только поля карточки: description и прочие тяжелые колонки
+# не читаются из базы, связи не подгружаются
+LISTING_CARD_LOAD = (
+    load_only(*(getattr(Listing, field) for field in ListingCardResponse.model_fields)),
+    raiseload('*'),
+)
+
+# Детальный ответ сериализует историю статусов - грузим ее сразу, объект не нужен
+LISTING_DETAIL_LOAD = [selectinload(Listing.status_logs)]
+
+# Подписи атрибутов метчинга для отображения
+MATCH_ATTRIBUTE_LABELS = {
+    'city': 'Город',
+    'street': 'Улица',
+    'house_number': 'Номер дома',
+    'rooms': 'Комнаты',
+    'area_total': 'Общая площадь',
+    'floor': 'Этаж',
+    'property_type': 'Тип недвижимости',
+    'district': 'Район',
+    'area_living': 'Жилая площадь',
+    'area_kitchen': 'Площадь кухни'
 }
 
-PROPERTY_TYPE_SLUG_TO_NAME = {
-    "kvartiry": "Квартиры",
-    "kvartiru": "Квартиры",
-    "komnaty": "Комнаты",
-    "komnatu": "Комнаты",
-    "doma": "Дома",
-    "dom": "Дома",
-    "uchastki": "Участки",
-    "uchastok": "Участки",
-    "kommercheskaya": "Коммерческая недвижимость",
-    "kommercheskuyu-nedvizhimost": "Коммерческая недвижимость",
+# Значения адресных атрибутов берутся из разобранного адреса, а не из колонок
+ADDRESS_VALUE_RESOLVERS = {
+    'city': lambda listing, parts: parts.get('city') or listing.city,
+    'street': lambda listing, parts: parts.get('street'),
+    'house_number': lambda listing, parts: parts.get('house_number'),
+    'district': lambda listing, parts: parts.get('district') or listing.district,
 }
 
 router = APIRouter(prefix="/api/listings", tags=["listings"])
 
 
+def _get_or_404(db: Session, listing_id: int, options: Optional[list] = None) -> Listing:
+    """Объявление по первичному ключу через identity map сессии или 404"""
+    listing = db.get(Listing, listing_id, options=options)
+    if not listing:
+        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    return listing
+
+
+def _fetch_page_with_total(query, offset: int, limit: int) -> Tuple[list, int]:
+    """Страница строк и общее число совпадений одним запросом через count(*) OVER ()"""
+    rows = query.add_columns(func.count().over().label("total_count"))\
+        .offset(offset)\
+        .limit(limit)\
+        .all()
+    if rows:
+        return [row[0] for row in rows], rows[0].total_count
+    # Страница за пределами выборки - окно не вернуло ни одной строки, считаем отдельно
+    total = query.order_by(None).count() if offset else 0
+    return [], total
+
+
 @router.get("", response_model=ListingListResponse)
 def get_listings(
     page: int = Query(1, ge=1),
@@ -49,31 +93,45 @@ def get_listings(
     min_rooms: Optional[int] = None,
     max_rooms: Optional[int] = None,
     search: Optional[str] = None,
+    sort_by: Optional[Literal["match_score", "parsed_at"]] = Query(
+        None,
+        description="Сортировка: parsed_at (по умолчанию) или match_score - "
+                    "только сопоставленные объявления, без курсора"
+    ),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor из прошлого ответа)"),
     db: Session = Depends(get_db)
 ):
-    """Получить список объявлений с фильтрацией и пагинацией"""
-    query = db.query(Listing)
+    """Получить список объявлений с фильтрацией и пагинацией.
+    
+    Поддерживает два режима: классический по page и keyset по cursor.
+    В режиме cursor total и pages не вычисляются.
+    """
+    # Полнотекстовый поиск не кэшируем - слишком много разных ключей
+    cache_key = None
+    if not search:
+        params = {
+            "page": page, "per_page": per_page, "city": city, "deal_type": deal_type,
+            "property_type": property_type, "is_active": is_active,
+            "min_price": min_price, "max_price": max_price,
+            "min_rooms": min_rooms, "max_rooms": max_rooms,
+            "sort_by": sort_by, "cursor": cursor,
+        }
+        cache_key = f"listings:list:{json.dumps(params, sort_keys=True)}"
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+    
+    query = db.query(Listing).options(*LISTING_CARD_LOAD)
     
     if city:
         query = query.filter(Listing.city.ilike(f"%{city}%"))
+    # В базе хранятся только канонические названия (нормализуются при записи)
     if deal_type:
-        deal_type_variants = [deal_type]
-        if deal_type in DEAL_TYPE_SLUG_TO_NAME:
-            deal_type_variants.append(DEAL_TYPE_SLUG_TO_NAME[deal_type])
-        for slug, name in DEAL_TYPE_SLUG_TO_NAME.items():
-            if name == deal_type:
-                deal_type_variants.append(slug)
-        
-        query = query.filter(Listing.deal_type.in_(deal_type_variants))
+        query = query.filter(Listing.deal_type == DEAL_TYPE_SLUG_TO_NAME.get(deal_type, deal_type))
     if property_type:
-        property_type_variants = [property_type]
-        if property_type in PROPERTY_TYPE_SLUG_TO_NAME:
-            property_type_variants.append(PROPERTY_TYPE_SLUG_TO_NAME[property_type])
-        for slug, name in PROPERTY_TYPE_SLUG_TO_NAME.items():
-            if name == property_type:
-                property_type_variants.append(slug)
-        
-        query = query.filter(Listing.property_type.in_(property_type_variants))
+        query = query.filter(
+            Listing.property_type == PROPERTY_TYPE_SLUG_TO_NAME.get(property_type, property_type)
+        )
     if is_active is not None:
         query = query.filter(Listing.is_active == is_active)
     if min_price:
@@ -85,38 +143,82 @@ def get_listings(
     if max_rooms is not None:
         query = query.filter(Listing.rooms <= max_rooms)
     if search:
+        # Одно ILIKE по склеенному тексту - использует trigram-индекс ix_listings_search_trgm
         query = query.filter(
-            or_(
-                Listing.title.ilike(f"%{search}%"),
-                Listing.address.ilike(f"%{search}%"),
-                Listing.description.ilike(f"%{search}%")
-            )
+            text(f"({LISTING_SEARCH_EXPRESSION}) ILIKE :search").bindparams(search=f"%{search}%")
         )
     
-    total = query.count()
-    pages = (total + per_page - 1) // per_page
+    if sort_by == "match_score":
+        if cursor:
+            raise HTTPException(status_code=400, detail="Курсор поддерживается только для сортировки по дате")
+        # Только сопоставленные объявления - попадает в частичный индекс ix_listings_match_score
+        query = query.filter(Listing.property_id.isnot(None))
+        items, total = _fetch_page_with_total(
+            query.order_by(Listing.match_score.desc().nullslast()),
+            (page - 1) * per_page,
+            per_page
+        )
+        response = ListingListResponse(
+            items=items,
+            total=total,
+            page=page,
+            per_page=per_page,
+            pages=(total + per_page - 1) // per_page
+        )
+    else:
+        response = _list_by_parsed_at(query, page, per_page, cursor)
     
-    items = query.order_by(Listing.parsed_at.desc())\
-        .offset((page - 1) * per_page)\
-        .limit(per_page)\
-        .all()
+    # Объявления уже провалидированы при сборке ListingListResponse - сериализуем
+    # в JSON сразу через pydantic-core, минуя повторную проверку по response_model
+    body = response.model_dump_json().encode()
+    if cache_key:
+        response_cache.set(cache_key, body)
+    return Response(content=body, media_type="application/json")
+
+
+def _list_by_parsed_at(query, page: int, per_page: int, cursor: Optional[str]) -> ListingListResponse:
+    """Страница объявлений по дате парсинга: offset по page или keyset по cursor"""
+    query = query.order_by(Listing.parsed_at.desc(), Listing.id.desc())
+    
+    if cursor:
+        # Keyset: продолжаем сразу после последней записи прошлой страницы
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        total = None
+        pages = None
+        rows = query.filter(tuple_(Listing.parsed_at, Listing.id) < (cursor_ts, cursor_id))\
+            .limit(per_page + 1)\
+            .all()
+    else:
+        rows, total = _fetch_page_with_total(query, (page - 1) * per_page, per_page + 1)
+        pages = (total + per_page - 1) // per_page
+    
+    # Лишняя строка показывает, есть ли следующая страница
+    items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1].parsed_at, items[-1].id) if len(rows) > per_page else None
     
     return ListingListResponse(
         items=items,
         total=total,
         page=page,
         per_page=per_page,
-        pages=pages
+        pages=pages,
+        next_cursor=next_cursor
     )
 
 
 @router.get("/{listing_id}", response_model=ListingResponse)
 def get_listing(listing_id: int, db: Session = Depends(get_db)):
     """Получить объявление по ID"""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
-    return listing
+    cache_key = f"listings:item:{listing_id}"
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    listing = _get_or_404(db, listing_id, options=LISTING_DETAIL_LOAD)
+    
+    response = ListingResponse.model_validate(listing)
+    response_cache.set(cache_key, response)
+    return response
 
 
 @router.put("/{listing_id}", response_model=ListingResponse)
@@ -126,15 +228,16 @@ def update_listing(
     db: Session = Depends(get_db)
 ):
     """Обновить объявление"""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    listing = _get_or_404(db, listing_id)
     
     update_data = listing_update.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(listing, key, value)
     
     db.commit()
+    response_cache.invalidate("listings:")
+    # property_id и is_active влияют на статистику объектов
+    response_cache.invalidate("properties:")
     db.refresh(listing)
     return listing
 
@@ -142,51 +245,58 @@ def update_listing(
 @router.delete("/{listing_id}")
 def delete_listing(listing_id: int, db: Session = Depends(get_db)):
     """Удалить объявление"""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    listing = _get_or_404(db, listing_id)
     
     db.delete(listing)
     db.commit()
+    response_cache.invalidate("listings:")
+    response_cache.invalidate("properties:")
     return {"message": "Объявление удалено", "id": listing_id}
 
 
 @router.get("/stats/summary")
 def get_listings_stats(db: Session = Depends(get_db)):
     """Получить статистику по объявлениям"""
-    total = db.query(Listing).count()
-    active = db.query(Listing).filter(Listing.is_active == True).count()
-    
-    by_deal_type = {}
-    for deal_type in ['Продажа', 'Аренда']:
-        count = db.query(Listing).filter(Listing.deal_type == deal_type).count()
-        if count > 0:
-            by_deal_type[deal_type] = count
-    for deal_type in ['prodam', 'sdam', 'sale', 'rent']:
-        count = db.query(Listing).filter(Listing.deal_type == deal_type).count()
-        if count > 0:
-            by_deal_type[deal_type] = count
-    
-    from sqlalchemy import func
+    cached = response_cache.get("listings:stats")
+    if cached is not None:
+        return cached
+    
+    # Счетчики одним проходом по таблице
+    deal_type_names = ['Продажа', 'Аренда']
+    columns = [
+        func.count(Listing.id),
+        func.count(case((Listing.is_active == True, 1))),
+    ]
+    for name in deal_type_names:
+        columns.append(func.count(case((Listing.deal_type == name, 1))))
+    
+    total, active, *deal_type_counts = db.query(*columns).one()
+    
+    by_deal_type = {
+        name: count
+        for name, count in zip(deal_type_names, deal_type_counts)
+        if count > 0
+    }
+    
     cities = db.query(
         Listing.city, func.count(Listing.id).label('count')
     ).group_by(Listing.city).order_by(func.count(Listing.id).desc()).limit(5).all()
     
-    return {
+    stats = {
         "total": total,
         "active": active,
         "inactive": total - active,
         "by_deal_type": by_deal_type,
         "top_cities": [{"city": c[0], "count": c[1]} for c in cities if c[0]]
     }
+    response_cache.set("listings:stats", stats)
+    return stats
 
 
 @router.post("/{listing_id}/parse-details", response_model=ListingResponse)
 def parse_listing_details(listing_id: int, db: Session = Depends(get_db)):
     """Спарсить полные данные объявления с детальной страницы"""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    listing = _get_or_404(db, listing_id)
     
     if not listing.url:
         raise HTTPException(status_code=400, detail="У объявления нет URL")
@@ -197,40 +307,26 @@ def parse_listing_details(listing_id: int, db: Session = Depends(get_db)):
     if not listing_data:
         raise HTTPException(status_code=500, detail="Не удалось извлечь данные со страницы")
     
-    if 'price' in listing_data:
-        listing.price = listing_data['price']
-    if 'rooms' in listing_data:
-        listing.rooms = listing_data['rooms']
-    if 'floor' in listing_data:
-        listing.floor = listing_data['floor']
-    if 'floors_total' in listing_data:
-        listing.floors_total = listing_data['floors_total']
-    if 'area_total' in listing_data:
-        listing.area_total = listing_data['area_total']
-    if 'area_living' in listing_data:
-        listing.area_living = listing_data['area_living']
-    if 'area_kitchen' in listing_data:
-        listing.area_kitchen = listing_data['area_kitchen']
-    if 'address' in listing_data and listing_data['address']:
-        listing.address = listing_data['address']
-    if 'description' in listing_data:
-        listing.description = listing_data['description']
-    if 'title' in listing_data:
-        listing.title = listing_data['title']
-    if 'metro' in listing_data:
-        listing.metro = listing_data['metro']
-    if 'metro_time' in listing_data:
-        listing.metro_time = listing_data['metro_time']
-    if 'metro_transport' in listing_data:
-        listing.metro_transport = listing_data['metro_transport']
-    
-    from datetime import datetime
-    listing.parsed_at = datetime.utcnow()
+    values = {
+        key: value for key, value in listing_data.items()
+        if key in PARSEABLE_FIELDS and (key != 'address' or value)
+    }
+    values['parsed_at'] = datetime.now(timezone.utc)
+    
+    # Один UPDATE ... RETURNING вместо flush через unit of work и повторного SELECT в refresh
+    stmt = update(Listing)\
+        .where(Listing.id == listing_id)\
+        .values(values)\
+        .returning(Listing)\
+        .execution_options(populate_existing=True)
+    listing = db.execute(stmt).scalar_one()
+    # Сериализуем до commit: после него объект истекает и чтение атрибутов снова пошло бы в базу
+    response = ListingResponse.model_validate(listing)
     
     db.commit()
-    db.refresh(listing)
+    response_cache.invalidate("listings:")
     
-    return listing
+    return response
 
 
 @router.get("/{listing_id}/sale-probability")
@@ -240,9 +336,8 @@ def get_sale_probability(
     include_details: bool = Query(True, description="Включать детальную информацию")
 ):
     """Вычислить вероятность продажи объявления"""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    # Скорингу нужны только колонки объявления - связи не загружаем
+    listing = _get_or_404(db, listing_id, options=[raiseload('*')])
     
     has_sufficient_data = (
         listing.price is not None or
@@ -267,9 +362,7 @@ def get_sale_probability(
 @router.get("/{listing_id}/match-details")
 def get_match_details(listing_id: int, db: Session = Depends(get_db)):
     """Получить детали метчинга объявления с объектом недвижимости"""
-    listing = db.query(Listing).filter(Listing.id == listing_id).first()
-    if not listing:
-        raise HTTPException(status_code=404, detail="Объявление не найдено")
+    listing = _get_or_404(db, listing_id, options=[selectinload(Listing.property), raiseload('*')])
     
     if not listing.property_id:
         return {
@@ -288,49 +381,25 @@ def get_match_details(listing_id: int, db: Session = Depends(get_db)):
     matcher = PropertyMatcher(db)
     match_result = matcher._calculate_similarity(listing, property_obj)
     
-    # Форматируем результаты для отображения
-    attribute_labels = {
-        'city': 'Город',
-        'street': 'Улица',
-        'house_number': 'Номер дома',
-        'rooms': 'Комнаты',
-        'area_total': 'Общая площадь',
-        'floor': 'Этаж',
-        'property_type': 'Тип недвижимости',
-        'district': 'Район',
-        'area_living': 'Жилая площадь',
-        'area_kitchen': 'Площадь кухни'
-    }
+    # Адрес разбираем один раз на все адресные атрибуты
+    address_parts = matcher._extract_address_parts(listing)
     
     matched_details = []
     for attr_name, (matches, similarity) in match_result.matched_attributes.items():
-        label = attribute_labels.get(attr_name, attr_name)
-        is_strict = attr_name in match_result.strict_violations
-        
-        # Получаем значения из объявления и объекта
-        listing_val = getattr(listing, attr_name, None)
-        if attr_name in ['city', 'street', 'house_number', 'district']:
-            # Для адресных полей используем специальную логику
-            address_parts = matcher._extract_address_parts(listing)
-            if attr_name == 'city':
-                listing_val = address_parts.get('city') or listing.city
-            elif attr_name == 'street':
-                listing_val = address_parts.get('street')
-            elif attr_name == 'house_number':
-                listing_val = address_parts.get('house_number')
-            elif attr_name == 'district':
-                listing_val = address_parts.get('district') or listing.district
-        
-        property_val = getattr(property_obj, attr_name, None)
+        resolver = ADDRESS_VALUE_RESOLVERS.get(attr_name)
+        if resolver:
+            listing_val = resolver(listing, address_parts)
+        else:
+            listing_val = getattr(listing, attr_name, None)
         
         matched_details.append({
             'attribute': attr_name,
-            'label': label,
+            'label': MATCH_ATTRIBUTE_LABELS.get(attr_name, attr_name),
             'matches': matches,
             'similarity': similarity,
             'is_strict': attr_name in matcher.strict_attrs,
             'listing_value': listing_val,
-            'property_value': property_val,
+            'property_value': getattr(property_obj, attr_name, None),
             'weight': matcher.weights.get(attr_name, 0.0)
         })
     
@@ -1,23 +1,153 @@
+import re
+import json
 import logging
-from fastapi import APIRouter, Depends, BackgroundTasks
+from functools import lru_cache
+from typing import Optional
+from fastapi import APIRouter, Depends, BackgroundTasks, Request, Response
+from sqlalchemy import func, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
 
-from app.database import get_db
+from app.database import engine, get_db
 from app.schemas.parser import ParserConfig, ParserResult, RemoveCheckResult
 from app.services.cian_parser import CianParser
 from app.models import Listing
+from app.services.cache import response_cache
+from app.services.property_cities import refresh_property_cities_safely
 
 router = APIRouter(prefix="/api/parser", tags=["parser"])
 logger = logging.getLogger(__name__)
 
+# Поля, которые отладочный endpoint ищет в HTML Cian, - за один проход по байтам
+_CIAN_FIELDS_RE = re.compile(rb'"(cianId|price|roomsCount|floorNumber)":(\d+)')
+_CIAN_BLOCK_RE = re.compile(rb'captcha|blocked', re.IGNORECASE)
+
+AVAILABLE_CITIES = {
+    "cities": [
+        {"slug": "spb", "name": "Санкт-Петербург"},
+        {"slug": "moskva", "name": "Москва"},
+        {"slug": "ekaterinburg", "name": "Екатеринбург"},
+        {"slug": "novosibirsk", "name": "Новосибирск"},
+        {"slug": "kazan", "name": "Казань"},
+        {"slug": "nizhny-novgorod", "name": "Нижний Новгород"},
+        {"slug": "chelyabinsk", "name": "Челябинск"},
+        {"slug": "samara", "name": "Самара"},
+        {"slug": "rostov-na-donu", "name": "Ростов-на-Дону"},
+        {"slug": "ufa", "name": "Уфа"},
+    ]
+}
+
+AVAILABLE_CATEGORIES = {
+    "categories": [
+        {"slug": "kvartiry", "name": "Квартиры"},
+        {"slug": "komnaty", "name": "Комнаты"},
+        {"slug": "doma", "name": "Дома"},
+        {"slug": "uchastki", "name": "Участки"},
+        {"slug": "kommercheskaya", "name": "Коммерческая недвижимость"},
+    ]
+}
+
+AVAILABLE_DEAL_TYPES = {
+    "deal_types": [
+        {"slug": "sale", "name": "Продажа"},
+        {"slug": "rent", "name": "Аренда"},
+    ]
+}
+
+# Справочники и заголовки отладочного запроса к Cian
+_DEBUG_CITY_DOMAINS = {
+    "moskva": "https://www.cian.ru",
+    "spb": "https://spb.cian.ru",
+}
+_DEBUG_DEAL_TYPES = {"sale": "kupit", "rent": "snyat"}
+_DEBUG_PROPERTY_TYPES = {"kvartiry": "kvartiru", "komnaty": "komnatu", "doma": "dom"}
+
+_DEBUG_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+
+@lru_cache(maxsize=256)
+def _build_debug_url(city: str, deal_type: str, category: str) -> str:
+    """URL страницы поиска Cian для отладочного запроса"""
+    base_domain = _DEBUG_CITY_DOMAINS.get(city, f"https://{city}.cian.ru")
+    deal = _DEBUG_DEAL_TYPES.get(deal_type, "kupit")
+    prop_type = _DEBUG_PROPERTY_TYPES.get(category, "kvartiru")
+    return f"{base_domain}/{deal}-{prop_type}/"
+
+
+def _static_json_response(payload: dict) -> Response:
+    """Готовый ответ со статичным JSON: сериализуется один раз при импорте"""
+    return Response(
+        content=json.dumps(payload, ensure_ascii=False).encode(),
+        media_type="application/json",
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
+# Справочники не меняются во время работы процесса - отдаем готовые байты
+_CITIES_RESPONSE = _static_json_response(AVAILABLE_CITIES)
+_CATEGORIES_RESPONSE = _static_json_response(AVAILABLE_CATEGORIES)
+_DEAL_TYPES_RESPONSE = _static_json_response(AVAILABLE_DEAL_TYPES)
+
+
 parsing_status = {
     "is_running": False,
     "progress": None,
     "last_result": None
 }
 
+# Ключ advisory lock PostgreSQL, которым помечается идущий парсинг.
+# Блокировка видна всем воркерам, в отличие от parsing_status в памяти процесса
+PARSER_LOCK_KEY = 7_310_001
+
+
+def _acquire_parsing_lock() -> Optional[Connection]:
+    """Атомарно захватывает блокировку парсинга; возвращает соединение-владельца или None"""
+    # Сессионная блокировка живет, пока открыто соединение. AUTOCOMMIT - чтобы соединение
+    # не висело весь парсинг в открытой транзакции (idle_in_transaction_session_timeout)
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    acquired = conn.execute(
+        text("SELECT pg_try_advisory_lock(:key)"), {"key": PARSER_LOCK_KEY}
+    ).scalar()
+    if not acquired:
+        conn.close()
+        return None
+    return conn
 
-def run_parsing_task(config: ParserConfig, db: Session):
+
+def _release_parsing_lock(conn: Connection):
+    """Освобождает блокировку парсинга и возвращает соединение в пул"""
+    try:
+        conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PARSER_LOCK_KEY})
+    finally:
+        conn.close()
+
+
+def _is_parsing_locked(db: Session) -> bool:
+    """Проверяет, выполняется ли парсинг в каком-либо воркере"""
+    # Ключ bigint: старшие 32 бита в classid, младшие в objid, objsubid = 1
+    # (у формы с двумя int-ключами objsubid = 2); блокировки других баз не учитываем
+    return db.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_locks "
+            "WHERE locktype = 'advisory' AND granted "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+            "AND classid = 0 AND objid = :key AND objsubid = 1)"
+        ),
+        {"key": PARSER_LOCK_KEY}
+    ).scalar()
+
+
+def _refresh_after_parsing(db: Session):
+    """Сбрасывает кэш и пересчитывает список городов; ошибка здесь не делает парсинг неуспешным"""
+    response_cache.invalidate()
+    refresh_property_cities_safely(db)
+
+
+def run_parsing_task(config: ParserConfig, db: Session, lock_conn: Connection):
     """Фоновая задача парсинга (Cian)"""
     global parsing_status
     parsing_status["is_running"] = True
@@ -38,8 +168,11 @@ def run_parsing_task(config: ParserConfig, db: Session):
         logger.error(f"Parsing error: {e}")
         parsing_status["progress"] = f"Error: {str(e)}"
         parsing_status["last_result"] = {"error": str(e)}
+    else:
+        _refresh_after_parsing(db)
     finally:
         parsing_status["is_running"] = False
+        _release_parsing_lock(lock_conn)
 
 
 @router.post("/start", response_model=dict)
@@ -49,15 +182,14 @@ def start_parsing(
     db: Session = Depends(get_db)
 ):
     """Запустить парсинг в фоновом режиме"""
-    global parsing_status
-    
-    if parsing_status["is_running"]:
+    lock_conn = _acquire_parsing_lock()
+    if lock_conn is None:
         return {
             "message": "Парсинг уже выполняется",
             "status": "already_running"
         }
     
-    background_tasks.add_task(run_parsing_task, config, db)
+    background_tasks.add_task(run_parsing_task, config, db, lock_conn)
     
     return {
         "message": "Парсинг запущен",
@@ -74,7 +206,8 @@ def start_parsing_sync(
     """Запустить парсинг синхронно (для тестирования)"""
     global parsing_status
     
-    if parsing_status["is_running"]:
+    lock_conn = _acquire_parsing_lock()
+    if lock_conn is None:
         return ParserResult(
             total_found=0,
             new_listings=0,
@@ -95,23 +228,30 @@ def start_parsing_sync(
             filters=config.filters
         )
         parsing_status["last_result"] = result
+        _refresh_after_parsing(db)
         return ParserResult(**result)
     finally:
         parsing_status["is_running"] = False
+        _release_parsing_lock(lock_conn)
 
 
 @router.get("/status")
-def get_parsing_status():
+def get_parsing_status(db: Session = Depends(get_db)):
     """Получить статус текущего парсинга"""
-    return parsing_status
+    return {**parsing_status, "is_running": _is_parsing_locked(db)}
 
 
 @router.post("/check-removed", response_model=RemoveCheckResult)
 def check_removed_listings(db: Session = Depends(get_db)):
     """Проверить снятые объявления"""
-    active_count = db.query(Listing).filter(Listing.is_active == True).count()
+    # Число активных нужно для ответа; плоский count(*) без подзапроса
+    # проходит по частичному индексу ix_listings_active_city_deal
+    active_count = db.query(func.count()).select_from(Listing)\
+        .filter(Listing.is_active == True)\
+        .scalar()
     
     # TODO: implement check_removed_listings for Cian
+    # (активные объявления читать через yield_per, снятые помечать одним update())
     removed = 0
     
     return RemoveCheckResult(
@@ -123,117 +263,66 @@ def check_removed_listings(db: Session = Depends(get_db)):
 @router.get("/config/cities")
 def get_available_cities():
     """Получить список доступных городов (Cian)"""
-    return {
-        "cities": [
-            {"slug": "spb", "name": "Санкт-Петербург"},
-            {"slug": "moskva", "name": "Москва"},
-            {"slug": "ekaterinburg", "name": "Екатеринбург"},
-            {"slug": "novosibirsk", "name": "Новосибирск"},
-            {"slug": "kazan", "name": "Казань"},
-            {"slug": "nizhny-novgorod", "name": "Нижний Новгород"},
-            {"slug": "chelyabinsk", "name": "Челябинск"},
-            {"slug": "samara", "name": "Самара"},
-            {"slug": "rostov-na-donu", "name": "Ростов-на-Дону"},
-            {"slug": "ufa", "name": "Уфа"},
-        ]
-    }
+    return _CITIES_RESPONSE
 
 
 @router.get("/config/categories")
 def get_available_categories():
     """Получить список доступных категорий (Cian)"""
-    return {
-        "categories": [
-            {"slug": "kvartiry", "name": "Квартиры"},
-            {"slug": "komnaty", "name": "Комнаты"},
-            {"slug": "doma", "name": "Дома"},
-            {"slug": "uchastki", "name": "Участки"},
-            {"slug": "kommercheskaya", "name": "Коммерческая недвижимость"},
-        ]
-    }
+    return _CATEGORIES_RESPONSE
 
 
 @router.get("/config/deal-types")
 def get_available_deal_types():
     """Получить список типов сделок (Cian)"""
-    return {
-        "deal_types": [
-            {"slug": "sale", "name": "Продажа"},
-            {"slug": "rent", "name": "Аренда"},
-        ]
-    }
+    return _DEAL_TYPES_RESPONSE
 
 
 @router.get("/debug/fetch")
-def debug_fetch_page(
+async def debug_fetch_page(
+    request: Request,
     city: str = "spb",
     category: str = "kvartiry",
     deal_type: str = "sale"
 ):
     """Отладочный endpoint - показывает что приходит от Cian"""
-    import httpx
-    import re
-    
-    # Строим URL для Cian
-    CITY_DOMAINS = {
-        "moskva": "https://www.cian.ru",
-        "spb": "https://spb.cian.ru",
-    }
-    DEAL_TYPES = {"sale": "kupit", "rent": "snyat"}
-    PROPERTY_TYPES = {"kvartiry": "kvartiru", "komnaty": "komnatu", "doma": "dom"}
-    
-    base_domain = CITY_DOMAINS.get(city, f"https://{city}.cian.ru")
-    deal = DEAL_TYPES.get(deal_type, "kupit")
-    prop_type = PROPERTY_TYPES.get(category, "kvartiru")
-    url = f"{base_domain}/{deal}-{prop_type}/"
-    
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-    }
+    url = _build_debug_url(city, deal_type, category)
     
     try:
-        with httpx.Client(headers=headers, timeout=30.0, follow_redirects=True) as client:
-            response = client.get(url)
-            
-            html = response.text
-            
-            result = {
-                "source": "cian",
-                "request_url": url,
-                "final_url": str(response.url),
-                "status_code": response.status_code,
-                "html_length": len(html),
-            }
-            
-            # Ищем cianId в HTML
-            cian_ids = re.findall(r'"cianId":(\d+)', html)
-            unique_ids = list(dict.fromkeys(cian_ids))
-            result["unique_cian_ids"] = len(unique_ids)
-            result["sample_ids"] = unique_ids[:5]
-            
-            # Ищем цены
-            prices = re.findall(r'"price":(\d+)', html)
-            result["prices_found"] = len(prices)
-            result["sample_prices"] = [int(p) for p in prices[:5]]
-            
-            # Ищем комнаты
-            rooms = re.findall(r'"roomsCount":(\d+)', html)
-            result["rooms_found"] = len(rooms)
-            
-            # Ищем этажи
-            floors = re.findall(r'"floorNumber":(\d+)', html)
-            result["floors_found"] = len(floors)
-            
-            # Проверяем блокировку
-            if 'captcha' in html.lower() or 'blocked' in html.lower():
-                result["has_captcha"] = True
-            else:
-                result["has_captcha"] = False
-            
-            return result
-            
+        response = await request.app.state.http.get(url, headers=_DEBUG_HEADERS)
+        
+        content = response.content
+        
+        result = {
+            "source": "cian",
+            "request_url": url,
+            "final_url": str(response.url),
+            "status_code": response.status_code,
+            "html_length": len(content),  # в байтах, без декодирования тела
+        }
+        
+        buckets = {"cianId": [], "price": [], "roomsCount": [], "floorNumber": []}
+        for match in _CIAN_FIELDS_RE.finditer(content):
+            buckets[match.group(1).decode()].append(int(match.group(2)))
+        
+        # cianId
+        unique_ids = [str(i) for i in dict.fromkeys(buckets["cianId"])]
+        result["unique_cian_ids"] = len(unique_ids)
+        result["sample_ids"] = unique_ids[:5]
+        
+        # Цены
+        result["prices_found"] = len(buckets["price"])
+        result["sample_prices"] = buckets["price"][:5]
+        
+        # Комнаты и этажи
+        result["rooms_found"] = len(buckets["roomsCount"])
+        result["floors_found"] = len(buckets["floorNumber"])
+        
+        # Проверяем блокировку
+        result["has_captcha"] = _CIAN_BLOCK_RE.search(content) is not None
+        
+        return result
+    
     except Exception as e:
         import traceback
         return {"error": str(e), "traceback": traceback.format_exc()}
@@ -1,54 +1,66 @@
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+import json
+from typing import Iterator, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, selectinload, raiseload
+from sqlalchemy import func, or_, tuple_, case, select, literal_column
 
-from app.database import get_db
+from app.database import SessionLocal, get_db
 from app.models import Property, Listing
-from app.schemas.property import PropertyResponse, PropertyListResponse, PropertyUpdate
+from app.models.listing import PROPERTY_TYPE_SLUG_TO_NAME
+from app.models.property import CITY_SLUG_TO_NAME
+from app.schemas.property import PropertyResponse, PropertyListResponse, PropertyUpdate, PropertyExportItem
 from app.services.property_matcher import PropertyMatcher
+from app.services.cache import response_cache, conditional_json_response
+from app.services.pagination import encode_cursor, decode_cursor
+from app.services.property_cities import (
+    get_property_cities, refresh_property_cities_safely, refresh_property_cities_task
+)
 
-CITY_SLUG_TO_NAME = {
-    "spb": "Санкт-Петербург",
-    "sankt-peterburg": "Санкт-Петербург",
-    "moskva": "Москва",
-    "ekaterinburg": "Екатеринбург",
-    "novosibirsk": "Новосибирск",
-    "kazan": "Казань",
-    "nizhny-novgorod": "Нижний Новгород",
-    "chelyabinsk": "Челябинск",
-    "samara": "Самара",
-    "rostov-na-donu": "Ростов-на-Дону",
-    "ufa": "Уфа",
-}
-
-DEAL_TYPE_SLUG_TO_NAME = {
-    "sale": "Продажа",
-    "rent": "Аренда",
-    "prodam": "Продажа",
-    "sdam": "Аренда",
-    "kupit": "Продажа",
-    "snyat": "Аренда",
-}
-
-PROPERTY_TYPE_SLUG_TO_NAME = {
-    "kvartiry": "Квартиры",
-    "kvartiru": "Квартиры",
-    "komnaty": "Комнаты",
-    "komnatu": "Комнаты",
-    "doma": "Дома",
-    "dom": "Дома",
-    "uchastki": "Участки",
-    "uchastok": "Участки",
-    "kommercheskaya": "Коммерческая недвижимость",
-    "kommercheskuyu-nedvizhimost": "Коммерческая недвижимость",
-}
+# Ответ с объектом содержит только краткие карточки объявлений: listings грузятся
+# одним IN-запросом, а их связи (status_logs, property) и прочие ленивые загрузки запрещены
+PROPERTY_LISTINGS_LOAD = (
+    selectinload(Property.listings).raiseload('*'),
+    raiseload('*'),
+)
+
+# Размер пачки строк при потоковой выгрузке
+EXPORT_BATCH_SIZE = 1000
 
 router = APIRouter(prefix="/api/properties", tags=["properties"])
 
 
+def _apply_property_filters(
+    query,
+    city: Optional[str],
+    property_type: Optional[str],
+    min_rooms: Optional[int],
+    max_rooms: Optional[int],
+    min_area: Optional[float],
+    max_area: Optional[float],
+):
+    """Фильтры по колонкам объекта для запроса страницы"""
+    # В базе хранятся только канонические названия (нормализуются при записи)
+    if city:
+        query = query.filter(Property.city == CITY_SLUG_TO_NAME.get(city, city))
+    if property_type:
+        query = query.filter(
+            Property.property_type == PROPERTY_TYPE_SLUG_TO_NAME.get(property_type, property_type)
+        )
+    if min_rooms is not None:
+        query = query.filter(Property.rooms >= min_rooms)
+    if max_rooms is not None:
+        query = query.filter(Property.rooms <= max_rooms)
+    if min_area:
+        query = query.filter(Property.area_total >= min_area)
+    if max_area:
+        query = query.filter(Property.area_total <= max_area)
+    return query
+
+
 @router.get("", response_model=PropertyListResponse)
 def get_properties(
+    request: Request,
     page: int = Query(1, ge=1),
     per_page: int = Query(20, ge=1, le=100),
     city: Optional[str] = None,
@@ -60,115 +72,183 @@ def get_properties(
     min_price: Optional[int] = None,
     max_price: Optional[int] = None,
     sort_by: Optional[str] = Query(None, description="Сортировка: price_asc, price_desc, created_at"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы (next_cursor из прошлого ответа)"),
     db: Session = Depends(get_db)
 ):
-    """Получить список объектов недвижимости с фильтрацией"""
-    query = db.query(Property)
+    """Получить список объектов недвижимости с фильтрацией.
     
-    if city:
-        city_variants = [city]
-        for slug, name in CITY_SLUG_TO_NAME.items():
-            if name == city:
-                city_variants.append(slug)
-        if city in CITY_SLUG_TO_NAME:
-            city_variants.append(CITY_SLUG_TO_NAME[city])
-        
-        query = query.filter(Property.city.in_(city_variants))
-    if property_type:
-        property_type_variants = [property_type]
-        if property_type in PROPERTY_TYPE_SLUG_TO_NAME:
-            property_type_variants.append(PROPERTY_TYPE_SLUG_TO_NAME[property_type])
-        for slug, name in PROPERTY_TYPE_SLUG_TO_NAME.items():
-            if name == property_type:
-                property_type_variants.append(slug)
-        
-        query = query.filter(Property.property_type.in_(property_type_variants))
-    if min_rooms is not None:
-        query = query.filter(Property.rooms >= min_rooms)
-    if max_rooms is not None:
-        query = query.filter(Property.rooms <= max_rooms)
-    if min_area:
-        query = query.filter(Property.area_total >= min_area)
-    if max_area:
-        query = query.filter(Property.area_total <= max_area)
+    Для сортировки по дате создания кроме page поддерживается keyset по cursor,
+    в этом режиме total и pages не вычисляются.
+    """
+    by_created_at = sort_by not in ("price_asc", "price_desc")
+    if cursor and not by_created_at:
+        raise HTTPException(status_code=400, detail="Курсор поддерживается только для сортировки по дате")
     
-    needs_join = (min_price is not None or max_price is not None or sort_by in ["price_asc", "price_desc"])
+    # Число объявлений считается в том же запросе, что и страница объектов
+    query = db.query(Property, func.count(Listing.id).label("listings_count"))\
+        .outerjoin(Listing)\
+        .group_by(Property.id)
     
-    total_query = db.query(Property.id)
-    if city:
-        city_variants = [city]
-        for slug, name in CITY_SLUG_TO_NAME.items():
-            if name == city:
-                city_variants.append(slug)
-        if city in CITY_SLUG_TO_NAME:
-            city_variants.append(CITY_SLUG_TO_NAME[city])
-        
-        total_query = total_query.filter(Property.city.in_(city_variants))
-    if property_type:
-        property_type_variants = [property_type]
-        if property_type in PROPERTY_TYPE_SLUG_TO_NAME:
-            property_type_variants.append(PROPERTY_TYPE_SLUG_TO_NAME[property_type])
-        for slug, name in PROPERTY_TYPE_SLUG_TO_NAME.items():
-            if name == property_type:
-                property_type_variants.append(slug)
-        
-        total_query = total_query.filter(Property.property_type.in_(property_type_variants))
-    if min_rooms is not None:
-        total_query = total_query.filter(Property.rooms >= min_rooms)
-    if max_rooms is not None:
-        total_query = total_query.filter(Property.rooms <= max_rooms)
-    if min_area:
-        total_query = total_query.filter(Property.area_total >= min_area)
-    if max_area:
-        total_query = total_query.filter(Property.area_total <= max_area)
-    
-    if min_price is not None or max_price is not None:
-        total_query = total_query.join(Listing).group_by(Property.id)
-        if min_price is not None:
-            total_query = total_query.having(func.min(Listing.price) >= min_price)
-        if max_price is not None:
-            total_query = total_query.having(func.max(Listing.price) <= max_price)
-        total = total_query.count()
+    query = _apply_property_filters(query, city, property_type, min_rooms, max_rooms, min_area, max_area)
+    
+    if cursor:
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Property.created_at, Property.id) < (cursor_ts, cursor_id))
+    
+    # Агрегаты цены объявляются один раз. В ORDER BY ссылаемся на колонку ответа по имени:
+    # с nulls_last() метка сама не подставляется, и агрегат вычислялся бы повторно
+    min_price_col = func.min(Listing.price).label("min_price")
+    max_price_col = func.max(Listing.price).label("max_price")
+    
+    if min_price is not None:
+        query = query.having(min_price_col >= min_price)
+    if max_price is not None:
+        query = query.having(max_price_col <= max_price)
+    
+    if sort_by == "price_asc":
+        query = query.add_columns(min_price_col).order_by(literal_column("min_price").asc().nulls_last())
+    elif sort_by == "price_desc":
+        query = query.add_columns(max_price_col).order_by(literal_column("max_price").desc().nulls_last())
     else:
-        total = total_query.distinct().count()
-    
-    pages = (total + per_page - 1) // per_page
-    
-    if needs_join:
-        query = query.outerjoin(Listing).group_by(Property.id)
-        
-        if min_price is not None:
-            query = query.having(func.min(Listing.price) >= min_price)
-        if max_price is not None:
-            query = query.having(func.max(Listing.price) <= max_price)
-        
-        if sort_by == "price_asc":
-            query = query.order_by(func.min(Listing.price).asc().nulls_last())
-        elif sort_by == "price_desc":
-            query = query.order_by(func.max(Listing.price).desc().nulls_last())
+        query = query.order_by(Property.created_at.desc(), Property.id.desc())
+    
+    page_query = query.options(*PROPERTY_LISTINGS_LOAD)
+    if not cursor:
+        # total приходит в каждой строке: окно считается после GROUP BY и HAVING,
+        # то есть по объектам, прошедшим все фильтры, включая цену
+        page_query = page_query.add_columns(func.count().over().label("total_count"))\
+            .offset((page - 1) * per_page)
+    # Лишняя строка показывает, есть ли следующая страница для курсора
+    rows = page_query.limit(per_page + 1).all()
+    
+    total = None
+    pages = None
+    if not cursor:
+        if rows:
+            total = rows[0].total_count
+        elif page > 1:
+            # Страница за пределами выборки - окно не вернуло строк, считаем отдельно
+            total = query.order_by(None).count()
         else:
-            query = query.order_by(Property.created_at.desc())
-    else:
-        query = query.order_by(Property.created_at.desc())
+            total = 0
+        pages = (total + per_page - 1) // per_page
     
-    items = query.offset((page - 1) * per_page).limit(per_page).all()
+    items = []
+    for row in rows[:per_page]:
+        property_obj = row[0]
+        property_obj.listings_count = row.listings_count
+        items.append(property_obj)
     
-    for item in items:
-        item.listings_count = len(item.listings)
+    next_cursor = None
+    if by_created_at and len(rows) > per_page:
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
     
-    return PropertyListResponse(
+    response = PropertyListResponse(
         items=items,
         total=total,
         page=page,
         per_page=per_page,
-        pages=pages
+        pages=pages,
+        next_cursor=next_cursor
+    )
+    # Объекты и вложенные объявления уже провалидированы при сборке ответа - сериализуем
+    # в JSON сразу через pydantic-core, минуя повторную проверку по response_model.
+    # Страница меняется после правок в UI, поэтому клиент всегда перепроверяет ее по ETag
+    return conditional_json_response(
+        request, response.model_dump_json().encode(), "private, no-cache"
     )
 
 
+def _iter_properties_ndjson(city: Optional[str], property_type: Optional[str]) -> Iterator[bytes]:
+    """Объекты недвижимости построчно в NDJSON, пачками через server-side cursor"""
+    # Собственная сессия: сессия из get_db закрывается до того, как ответ начнет отправляться
+    db = SessionLocal()
+    try:
+        stmt = _apply_property_filters(
+            select(Property), city, property_type, None, None, None, None
+        ).order_by(Property.id).options(raiseload('*'))
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)).scalars()
+        for batch in result.partitions():
+            yield b"".join(
+                PropertyExportItem.model_validate(property_obj).model_dump_json().encode() + b"\n"
+                for property_obj in batch
+            )
+    finally:
+        db.close()
+
+
+@router.get("/export")
+def export_properties(city: Optional[str] = None, property_type: Optional[str] = None):
+    """Выгрузить объекты недвижимости в NDJSON (потоково, без загрузки всей таблицы в память)"""
+    return StreamingResponse(
+        _iter_properties_ndjson(city, property_type),
+        media_type="application/x-ndjson"
+    )
+
+
+# Статичные пути объявляются до /{property_id}, иначе их перехватит маршрут с int-параметром
+@router.get("/cities")
+def get_cities(request: Request, db: Session = Depends(get_db)):
+    """Получить список всех городов из объектов недвижимости"""
+    body = response_cache.get("properties:cities")
+    if body is None:
+        body = json.dumps({"cities": get_property_cities(db)}, ensure_ascii=False).encode()
+        response_cache.set("properties:cities", body)
+    
+    # Список городов меняется редко - браузер может использовать его до минуты без запроса
+    return conditional_json_response(request, body, "private, max-age=60")
+
+
+@router.get("/stats/summary")
+def get_properties_stats(db: Session = Depends(get_db)):
+    """Получить статистику по объектам недвижимости"""
+    cached = response_cache.get("properties:stats")
+    if cached is not None:
+        return cached
+    
+    # Объекты с несколькими объявлениями: группируем только listings по property_id
+    # (частичный индекс ix_listings_property_id_price), без join с properties -
+    # внешний ключ гарантирует, что объект существует
+    multi_listing_query = select(func.count()).select_from(
+        select(Listing.property_id)
+        .where(Listing.property_id.isnot(None))
+        .group_by(Listing.property_id)
+        .having(func.count() > 1)
+        .subquery()
+    ).scalar_subquery()
+    
+    # Общее число, разбивка по типам и число объектов с несколькими объявлениями - одним запросом
+    property_types = ['kvartiry', 'doma_dachi_kottedzhi', 'komnaty']
+    total, multi_listing, *type_counts = db.query(
+        func.count(Property.id),
+        multi_listing_query,
+        *(
+            func.count(case((Property.property_type == PROPERTY_TYPE_SLUG_TO_NAME.get(ptype, ptype), 1)))
+            for ptype in property_types
+        )
+    ).one()
+    by_type = dict(zip(property_types, type_counts))
+    
+    cities = db.query(
+        Property.city, func.count(Property.id).label('count')
+    ).group_by(Property.city).order_by(func.count(Property.id).desc()).limit(5).all()
+    
+    stats = {
+        "total": total,
+        "with_multiple_listings": multi_listing,
+        "by_type": by_type,
+        "top_cities": [{"city": c[0], "count": c[1]} for c in cities if c[0]]
+    }
+    response_cache.set("properties:stats", stats)
+    return stats
+
+
 @router.get("/{property_id}", response_model=PropertyResponse)
 def get_property(property_id: int, db: Session = Depends(get_db)):
     """Получить объект недвижимости по ID"""
-    property_obj = db.query(Property).filter(Property.id == property_id).first()
+    property_obj = db.query(Property).options(*PROPERTY_LISTINGS_LOAD)\
+        .filter(Property.id == property_id)\
+        .first()
     if not property_obj:
         raise HTTPException(status_code=404, detail="Объект не найден")
     
@@ -180,24 +260,31 @@ def get_property(property_id: int, db: Session = Depends(get_db)):
 def update_property(
     property_id: int,
     property_update: PropertyUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Обновить объект недвижимости"""
-    property_obj = db.query(Property).filter(Property.id == property_id).first()
+    property_obj = db.get(Property, property_id)
     if not property_obj:
         raise HTTPException(status_code=404, detail="Объект не найден")
     
-    update_data = property_update.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(property_obj, key, value)
+    # Только переданные поля; присваивание через ORM, чтобы сработали @validates нормализации
+    if not property_update.model_fields_set:
+        return property_obj
+    for key in property_update.model_fields_set:
+        setattr(property_obj, key, getattr(property_update, key))
     
     db.commit()
+    response_cache.invalidate("properties:")
+    if "city" in property_update.model_fields_set:
+        # Пересчет представления - полный GROUP BY, правку одного объекта им не задерживаем
+        background_tasks.add_task(refresh_property_cities_task)
     db.refresh(property_obj)
     return property_obj
 
 
 @router.delete("/{property_id}")
-def delete_property(property_id: int, db: Session = Depends(get_db)):
+def delete_property(property_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Удалить объект недвижимости"""
     property_obj = db.query(Property).filter(Property.id == property_id).first()
     if not property_obj:
@@ -209,6 +296,8 @@ def delete_property(property_id: int, db: Session = Depends(get_db)):
     
     db.delete(property_obj)
     db.commit()
+    response_cache.invalidate()
+    background_tasks.add_task(refresh_property_cities_task)
     return {"message": "Объект удален", "id": property_id}
 
 
@@ -217,35 +306,6 @@ def rematch_properties(db: Session = Depends(get_db)):
     """Пересопоставить все объявления с объектами недвижимости"""
     matcher = PropertyMatcher(db)
     results = matcher.rematch_all_listings()
+    response_cache.invalidate()
+    refresh_property_cities_safely(db)
     return results
-
-
-@router.get("/cities")
-def get_cities(db: Session = Depends(get_db)):
-    """Получить список всех городов из объектов недвижимости"""
-    cities = db.query(Property.city).distinct().filter(Property.city.isnot(None)).order_by(Property.city).all()
-    return {"cities": [c[0] for c in cities if c[0]]}
-
-
-@router.get("/stats/summary")
-def get_properties_stats(db: Session = Depends(get_db)):
-    """Получить статистику по объектам недвижимости"""
-    total = db.query(Property).count()
-    
-    multi_listing = db.query(Property.id).join(Listing).group_by(Property.id)\
-        .having(func.count(Listing.id) > 1).count()
-    
-    by_type = {}
-    for ptype in ['kvartiry', 'doma_dachi_kottedzhi', 'komnaty']:
-        by_type[ptype] = db.query(Property).filter(Property.property_type == ptype).count()
-    
-    cities = db.query(
-        Property.city, func.count(Property.id).label('count')
-    ).group_by(Property.city).order_by(func.count(Property.id).desc()).limit(5).all()
-    
-    return {
-        "total": total,
-        "with_multiple_listings": multi_listing,
-        "by_type": by_type,
-        "top_cities": [{"city": c[0], "count": c[1]} for c in cities if c[0]]
-    }
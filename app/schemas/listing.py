@@ -79,17 +79,39 @@ class ListingResponse(ListingBase):
     property_id: Optional[int] = None
     match_score: Optional[float] = None  # Процент сходства с объектом недвижимости (0-100)
     is_active: bool
-    images: Optional[str] = None
+    image_urls: Optional[List[str]] = None
     parsed_at: datetime
     published_at: Optional[datetime] = None
     updated_at: datetime
     status_logs: List[StatusLogResponse] = []
 
 
+class ListingCardResponse(BaseModel):
+    """Краткая схема объявления для карточки в списке"""
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    avito_id: int
+    url: str
+    title: Optional[str] = None
+    deal_type: Optional[str] = None
+    property_type: Optional[str] = None
+    price: Optional[int] = None
+    city: Optional[str] = None
+    address: Optional[str] = None
+    rooms: Optional[int] = None
+    area_total: Optional[float] = None
+    property_id: Optional[int] = None
+    match_score: Optional[float] = None
+    is_active: bool
+    parsed_at: datetime
+
+
 class ListingListResponse(BaseModel):
     """Схема списка объявлений с пагинацией"""
-    items: List[ListingResponse]
-    total: int
+    items: List[ListingCardResponse]
+    total: Optional[int] = None  # Не вычисляется при пагинации по курсору
     page: int
     per_page: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
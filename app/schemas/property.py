@@ -63,10 +63,20 @@ class PropertyResponse(PropertyBase):
     listings_count: Optional[int] = None
 
 
+class PropertyExportItem(PropertyBase):
+    """Строка выгрузки объектов недвижимости (без вложенных объявлений)"""
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    created_at: datetime
+    updated_at: datetime
+
+
 class PropertyListResponse(BaseModel):
     """Схема списка объектов с пагинацией"""
     items: List[PropertyResponse]
-    total: int
+    total: Optional[int] = None  # Не вычисляется при пагинации по курсору
     page: int
     per_page: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
@@ -0,0 +1,64 @@
+"""
+In-process кэш с TTL для ответов API
+Кэш живет в памяти процесса: при нескольких воркерах устаревание ограничено TTL
+"""
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш с временем жизни записей.
+    Ключи - строки вида "<префикс>:<параметры>", инвалидация по префиксу.
+    """
+    
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Возвращает значение или None, если его нет или оно устарело"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Сохраняет значение, вытесняя самую старую запись при переполнении"""
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                del self._data[next(iter(self._data))]
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+    
+    def invalidate(self, prefix: Optional[str] = None):
+        """Удаляет записи с заданным префиксом (или все)"""
+        with self._lock:
+            if prefix is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if k.startswith(prefix)]:
+                    del self._data[key]
+
+
+# Общий кэш ответов API
+response_cache = TTLCache(ttl=60.0)
+
+
+def conditional_json_response(request: Request, body: bytes, cache_control: str) -> Response:
+    """JSON-ответ с ETag по содержимому; при совпадении If-None-Match - 304 без тела"""
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,23 +1,299 @@
 import re
-import json
+import asyncio
 import time
 import random
 import hashlib
 import logging
+import threading
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit
 
 import httpx
+import lxml.html
+import orjson
 from bs4 import BeautifulSoup
+from lxml import etree
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
 from app.config import get_settings
 from app.models import Listing, Property, StatusLog
+from app.models.listing import DEAL_TYPE_SLUG_TO_NAME, PROPERTY_TYPE_SLUG_TO_NAME
 from app.services.property_matcher import PropertyMatcher
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# JSON-поля объявления в тексте скриптов детальной страницы - все за один проход
+_CIAN_ID_RE = re.compile(r'"cianId":(\d+)')
+_DETAIL_FIELDS_RE = re.compile(r'"(price|roomsCount|floorNumber|floorsCount|totalArea|area)":(\d[0-9.]*)')
+_DETAIL_FIELD_KEYS = {
+    'price': 'price',
+    'roomsCount': 'rooms',
+    'floorNumber': 'floor',
+    'floorsCount': 'floors_total',
+    'totalArea': 'area_total',
+    'area': 'area_total',
+}
+_DETAIL_TEXT_FIELDS = frozenset(_DETAIL_FIELD_KEYS.values())
+
+# Поля объявления в JSON-контексте после cianId (fallback страницы поиска): строки и числа
+_LISTING_JSON_FIELDS_RE = re.compile(
+    r'"(price|objectType|dealType|roomsCount|floorNumber|floorsCount|totalArea|area|livingArea)":'
+    r'(?:"([^"]+)"|(\d[0-9.]*))'
+)
+_LISTING_JSON_FIELDS = {
+    'price': ('price', int),
+    'objectType': ('object_type', str),
+    'dealType': ('deal_type', str),
+    'roomsCount': ('rooms', int),
+    'floorNumber': ('floor', int),
+    'floorsCount': ('floors_total', int),
+    'totalArea': ('area_total', float),
+    'area': ('area_total', float),
+    'livingArea': ('area_total', float),
+}
+
+PARSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Cache-Control": "no-cache",
+    "Pragma": "no-cache",
+}
+
+# Правила обновления уже сохраненного объявления при повторном парсинге (save_listings_bulk):
+# эти поля перезаписываются, только если значение найдено на странице, иначе остается прежнее
+# (невалидное метро и "адрес" длиннее 200 символов _listing_row заменяет на None - они тоже
+# не затирают сохраненное); title и parsed_at обновляются всегда, остальные колонки не трогаются
+_UPSERT_KEEP_EXISTING = (
+    'price', 'rooms', 'floor', 'floors_total', 'area_total',
+    'address', 'metro', 'metro_time', 'metro_transport',
+)
+
+# Размер порции тела ответа, которой страница поиска подается в парсер lxml
+HTML_CHUNK_SIZE = 64 * 1024
+
+# Сколько разобранных страниц поиска парсер держит в памяти для повторных запросов
+SEARCH_PAGE_CACHE_SIZE = 64
+
+# Известные поля JSON детальной страницы: ключ -> (поле объявления, допустимые типы, преобразование)
+_JSON_FIELD_DISPATCH = {
+    'cianId': ('cian_id', (int, str), int),
+    'id': ('cian_id', (int, str), int),
+    'price': ('price', (int, float), int),
+    'roomsCount': ('rooms', int, None),
+    'floorNumber': ('floor', int, None),
+    'floorsCount': ('floors_total', int, None),
+    'kitchenArea': ('area_kitchen', (int, float), float),
+    'address': ('address', str, None),
+    'description': ('description', str, None),
+    'title': ('title', str, None),
+}
+# Площадь: totalArea перезаписывает, area и livingArea - только если площади еще нет
+_JSON_AREA_KEYS = frozenset({'totalArea', 'area', 'livingArea'})
+_JSON_FIELD_MARKERS = tuple(f'"{key}"' for key in (*_JSON_FIELD_DISPATCH, *_JSON_AREA_KEYS))
+
+# Пул соединений парсера: страницы одного города запрашиваются последовательно,
+# поэтому достаточно держать открытыми несколько соединений к поддоменам Cian
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=8, max_connections=16, keepalive_expiry=60.0)
+
+# Разбор карточек страницы поиска: XPath компилируются один раз при импорте
+_LISTING_HREF_RE = re.compile(r'/(?:sale|rent)/flat/(\d+)/')
+_SCRIPT_TEXTS_XPATH = etree.XPath("//script/text()", smart_strings=False)
+_LISTING_LINKS_XPATH = etree.XPath("//a[contains(@href, '/flat/')]")
+# Предки перебираются от ближайшего, поэтому [1] - ближайший подходящий
+_CARD_CONTAINER_XPATH = etree.XPath(
+    "ancestor::*[position() <= 10]"
+    "[contains(translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'container')"
+    " or contains(translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'card')][1]"
+)
+_CARD_FALLBACK_XPATH = etree.XPath("ancestor::*[position() <= 10][last()]")
+_CARD_LINKS_XPATH = etree.XPath(".//a[@href]")
+_ADDRESS_SPANS_XPATH = etree.XPath(
+    ".//span[contains(translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'address')]"
+)
+_UNDERGROUND_XPATH = etree.XPath(".//*[@data-name='Underground']")
+_TRAVEL_TIME_XPATH = etree.XPath(".//*[@data-name='GeoTravelTime']")
+_WALK_ICON_XPATH = etree.XPath(".//*[@data-name='walk']")
+_TRANSPORT_ICON_XPATH = etree.XPath(
+    ".//*[contains(@data-name, 'transport') or contains(@data-name, 'bus')]"
+)
+
+# Таблицы str.translate для цен: неразрывный пробел -> обычный; пробелы-разделители разрядов убираются
+_NBSP_TO_SPACE = str.maketrans({'\xa0': ' '})
+_DROP_DIGIT_SPACES = str.maketrans('', '', ' \xa0\u202f\u2009')
+
+# Шаблоны карточки на странице поиска
+_CARD_PRICE_RE = re.compile(r'(\d[\d\s]*\d)\s*₽')
+_CARD_DESC_RE = re.compile(r'(\d+-комн[^·]*·[^·]*м²[^·]*·[^·]*этаж)')
+_CARD_ROOMS_RE = re.compile(r'(\d+)-комн')
+_CARD_AREA_RE = re.compile(r'(\d+[,.]?\d*)\s*м²')
+_CARD_FLOOR_RE = re.compile(r'(\d+)/(\d+)\s*этаж')
+_LEADING_DIGITS_RE = re.compile(r'^\d+')
+_DIGITS_RE = re.compile(r'(\d+)')
+_METRO_NAME_RE = re.compile(r'([А-ЯЁ][А-Яа-яЁё\s\-]+)')
+_TRAILING_NUMBER_RE = re.compile(r'\s+\d+\s*$')
+_METRO_MINUTES_RE = re.compile(r'(\d+)\s*(?:мин|мин\.|минут)', re.IGNORECASE)
+_NEARBY_MINUTES_RE = re.compile(r'(\d+)\s*(?:мин|мин\.)')
+# "метро Название", "Название метро" или название станции со временем - вместе со словом,
+# без которого шаблон не может совпасть (ищется в тексте карточки в нижнем регистре)
+_CARD_METRO_RES = (
+    ('метро', re.compile(r'метро\s+([А-ЯЁ][А-Яа-яЁё\s\-]+)', re.IGNORECASE)),
+    ('метро', re.compile(r'([А-ЯЁ][А-Яа-яЁё\s\-]+)\s+метро', re.IGNORECASE)),
+    ('мин', re.compile(r'([А-ЯЁ][А-Яа-яЁё]{3,20})\s+\d+\s*мин', re.IGNORECASE)),
+)
+
+# Проверки названия станции метро: буквы как в классе [А-Яа-яЁё]
+_CYRILLIC_LETTERS = frozenset(map(chr, range(ord('А'), ord('я') + 1))) | {'Ё', 'ё'}
+_INVALID_METRO_WORDS = frozenset({
+    'минут', 'минуты', 'минута', 'мин', 'мин.',
+    'рядом', 'до', 'от', 'пешком', 'на', 'транспорт',
+    'автобус', 'bus', 'walk', 'transport',
+    'метро', 'подземн', 'станция', 'станции',
+    'и', 'или', 'к',
+})
+_INVALID_METRO_PREFIXES = tuple(
+    word + separator for word in _INVALID_METRO_WORDS for separator in (' ', ',')
+)
+
+# Шаблоны детальной страницы
+_DETAIL_PRICE_TEXT_RE = re.compile(r'\d+.*₽')
+_DESCRIPTION_CLASS_RE = re.compile(r'description')
+_FEATURE_TEXT_RE = re.compile(r'(комнат|м²|этаж|год|ремонт)')
+_FEATURE_ROOMS_RE = re.compile(r'(\d+)\s*комнат', re.IGNORECASE)
+_FEATURE_AREA_RE = re.compile(r'(\d+[,.]?\d*)\s*м[²2]')
+_FEATURE_FLOOR_RE = re.compile(r'(\d+)/(\d+)')
+_ADDRESS_CLASS_RE = re.compile(r'address')
+_METRO_TEXT_RE = re.compile(r'метро|подземн')
+_DETAIL_METRO_NAME_RE = re.compile(r'([А-Яа-яЁё\s\-]+)')
+
+
+def _node_text(node, separator: str) -> str:
+    """Текст узла из непустых фрагментов через separator, как get_text(separator, strip=True).
+    
+    Нужен там, где соседние узлы нельзя склеивать (цена, "2-комн. кв." и площадь
+    в разных span); для отдельного span достаточно text_content().
+    """
+    return separator.join(part.strip() for part in node.itertext() if part.strip())
+
+
+def _cian_id_contexts(html: str) -> Dict[str, str]:
+    """JSON-контекст (до 2000 символов) после первого вхождения каждого cianId - за один проход по HTML"""
+    contexts = {}
+    for match in _CIAN_ID_RE.finditer(html):
+        contexts.setdefault(match.group(1), html[match.end():match.end() + 2000])
+    return contexts
+
+
+@lru_cache(maxsize=4096)
+def _is_valid_metro_name(name: str) -> bool:
+    """Проверяет что название метро валидное (названия станций повторяются - результат кэшируется)"""
+    if not name:
+        return False
+    
+    # Проверяем длину (названия станций обычно 3-30 символов)
+    name_length = len(name.strip())
+    if name_length < 3 or name_length > 30:
+        return False
+    
+    name_lower = name.lower().strip()
+    
+    # Проверяем что это не одно из невалидных слов
+    if name_lower in _INVALID_METRO_WORDS:
+        return False
+    
+    # Проверяем что название не начинается с невалидных слов
+    if name_lower.startswith(_INVALID_METRO_PREFIXES):
+        return False
+    
+    # Проверяем что название содержит хотя бы одну русскую букву -
+    # тогда оно заведомо не состоит только из цифр и знаков
+    return not _CYRILLIC_LETTERS.isdisjoint(name)
+
+
+def _normalize_url(url: str) -> str:
+    """Ключ URL для дедупликации: хост в нижнем регистре без www., без фрагмента и пустого query"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return urlunsplit((parts.scheme.lower(), host, parts.path or '/', parts.query, ''))
+
+
+def _json_children(node):
+    """Пары (ключ, значение) dict или (None, элемент) list"""
+    if isinstance(node, dict):
+        return iter(node.items())
+    return ((None, item) for item in node)
+
+
+def _script_cian_id_contexts(tree) -> Dict[str, str]:
+    """Контексты cianId из JSON в скриптах разобранной страницы"""
+    contexts = {}
+    for script_text in _SCRIPT_TEXTS_XPATH(tree):
+        for cian_id, context in _cian_id_contexts(script_text).items():
+            contexts.setdefault(cian_id, context)
+    return contexts
+
+
+def _html_parser_for(response: httpx.Response) -> lxml.html.HTMLParser:
+    """Инкрементальный парсер lxml для тела ответа; кодировка - из заголовков, иначе UTF-8.
+    
+    Комментарии и processing instructions (трекинговые вставки) не попадают в дерево,
+    индекс id не строится - поиск идет по XPath. huge_tree снимает лимит libxml2
+    на размер текстового узла: JSON состояния страницы в <script> бывает очень большим.
+    Парсер нельзя делить между одновременными разборами (parse_many), поэтому он свой на ответ.
+    """
+    return lxml.html.HTMLParser(
+        encoding=response.charset_encoding or 'utf-8',
+        remove_comments=True,
+        remove_pis=True,
+        collect_ids=False,
+        huge_tree=True,
+    )
+
+
+_shared_client: Optional[httpx.Client] = None
+_shared_client_lock = threading.Lock()
+
+
+def _get_shared_client() -> httpx.Client:
+    """Синхронный HTTP-клиент парсера, общий для всех экземпляров CianParser в процессе.
+    
+    Парсер создается на каждый запрос к API (детали объявления, запуск парсинга), поэтому
+    собственный клиент каждый раз заново открывал TLS-соединение с Cian. Общий пул держит
+    соединения к поддоменам открытыми между запросами. HTTP/2: запросы к одному поддомену
+    идут по одному соединению, повторяющиеся заголовки сжимаются HPACK.
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = httpx.Client(
+                    http2=True,
+                    headers=PARSER_HEADERS,
+                    timeout=30.0,
+                    follow_redirects=True,
+                    limits=_HTTP_LIMITS,
+                )
+    return _shared_client
+
+
+def _detail_text_fields_filled(listing_data: Dict[str, Any]) -> bool:
+    """Заполнены ли все поля, которые ищутся в тексте скриптов (_DETAIL_FIELDS_RE)"""
+    return all(listing_data.get(key) for key in _DETAIL_TEXT_FIELDS)
+
+
+def _first(xpath, node):
+    """Первый узел по XPath или None"""
+    found = xpath(node)
+    return found[0] if found else None
+
 
 class CianParser:
     """Парсер объявлений недвижимости с Cian.ru"""
@@ -87,22 +363,54 @@ class CianParser:
         "kommercheskuyu-nedvizhimost": "Коммерческая недвижимость",
     }
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, aclient: Optional[httpx.AsyncClient] = None):
         self.db = db
-        self.property_matcher = PropertyMatcher(db)
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-            "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Cache-Control": "no-cache",
-            "Pragma": "no-cache",
-        }
-        self.client = httpx.Client(headers=self.headers, timeout=30.0, follow_redirects=True)
+        self._property_matcher: Optional[PropertyMatcher] = None
+        self.headers = PARSER_HEADERS
+        self.client = _get_shared_client()
+        # Асинхронный клиент можно передать (например, общий app.state.http) - тогда
+        # парсер его не закрывает; иначе создает свой при первом обращении
+        self._aclient: Optional[httpx.AsyncClient] = aclient
+        self._owns_aclient = aclient is None
+        # Уже разобранные страницы поиска (по нормализованному URL) и уже сохраненные за запуск cianId:
+        # повторный запрос страницы не идет в сеть, повторное объявление не сохраняется
+        self._search_page_cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._seen_cian_ids: set = set()
+    
+    @property
+    def property_matcher(self) -> PropertyMatcher:
+        """Матчер создается при первом сохранении - для парсинга деталей он не нужен"""
+        if self._property_matcher is None:
+            self._property_matcher = PropertyMatcher(self.db)
+        return self._property_matcher
+    
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        """Асинхронный клиент создается при первом обращении - внутри работающего event loop"""
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                http2=True,
+                headers=self.headers,
+                timeout=30.0,
+                follow_redirects=True,
+                limits=_HTTP_LIMITS,
+            )
+        return self._aclient
+    
+    async def aclose(self):
+        """Закрывает собственный асинхронный клиент (переданный и синхронный общий не закрываются)"""
+        if self._aclient is not None and self._owns_aclient:
+            await self._aclient.aclose()
+            self._aclient = None
     
-    def __del__(self):
-        if hasattr(self, 'client'):
-            self.client.close()
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _search_base_url(cls, city: str, category: str, deal_type: str) -> str:
+        """URL страницы поиска без параметров - одинаков для всех страниц выдачи"""
+        base_domain = cls.CITY_DOMAINS.get(city, f"https://{city}.cian.ru")
+        deal = cls.DEAL_TYPES.get(deal_type, "kupit")
+        prop_type = cls.PROPERTY_TYPES.get(category, "kvartiru")
+        return f"{base_domain}/{deal}-{prop_type}/"
     
     def build_search_url(
         self,
@@ -118,11 +426,11 @@ class CianParser:
         - https://spb.cian.ru/kupit-kvartiru/
         - https://spb.cian.ru/kupit-kvartiru/?p=2
         """
-        base_domain = self.CITY_DOMAINS.get(city, f"https://{city}.cian.ru")
-        deal = self.DEAL_TYPES.get(deal_type, "kupit")
-        prop_type = self.PROPERTY_TYPES.get(category, "kvartiru")
+        url = self._search_base_url(city, category, deal_type)
         
-        url = f"{base_domain}/{deal}-{prop_type}/"
+        # Обычный случай при пагинации - единственный параметр p
+        if not params:
+            return f"{url}?p={page}" if page > 1 else url
         
         query_params = {}
         if page > 1:
@@ -138,26 +446,44 @@ class CianParser:
     def parse_search_page(self, url: str) -> List[Dict[str, Any]]:
         """Парсит страницу поиска и возвращает список объявлений"""
         try:
-            logger.info(f"Fetching: {url}")
-            response = self.client.get(url)
-            
-            if response.status_code == 429:
-                logger.warning(f"Rate limited (429) for {url}")
-                return []
-            
-            response.raise_for_status()
-            html = response.text
+            cached = self._search_page_cache.get(_normalize_url(url))
+            if cached is not None:
+                logger.info(f"Already parsed: {url}")
+                return cached
             
-            logger.info(f"Response: {response.status_code}, {len(html)} bytes")
+            logger.info(f"Fetching: {url}")
+            # Тело не собирается в строку: байты по мере загрузки идут сразу в парсер lxml
+            with self.client.stream('GET', url) as response:
+                if not self._search_response_ok(url, response):
+                    return []
+                parser = _html_parser_for(response)
+                for chunk in response.iter_bytes(HTML_CHUNK_SIZE):
+                    parser.feed(chunk)
+            return self._listings_from_search_tree(url, response, parser.close())
             
-            listings = self._extract_listings_from_html(html)
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP error: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Error parsing {url}: {e}")
+            return []
+    
+    async def aparse_search_page(self, url: str) -> List[Dict[str, Any]]:
+        """Асинхронный вариант parse_search_page"""
+        try:
+            cached = self._search_page_cache.get(_normalize_url(url))
+            if cached is not None:
+                logger.info(f"Already parsed: {url}")
+                return cached
             
-            if listings:
-                logger.info(f"Found {len(listings)} listings")
-            else:
-                logger.warning(f"No listings found on {url}")
-                
-            return listings
+            logger.info(f"Fetching: {url}")
+            async with self.aclient.stream('GET', url, headers=self.headers) as response:
+                if not self._search_response_ok(url, response):
+                    return []
+                parser = _html_parser_for(response)
+                async for chunk in response.aiter_bytes(HTML_CHUNK_SIZE):
+                    parser.feed(chunk)
+            return self._listings_from_search_tree(url, response, parser.close())
             
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP error: {e}")
@@ -166,23 +492,63 @@ class CianParser:
             logger.error(f"Error parsing {url}: {e}")
             return []
     
-    def _extract_listings_from_html(self, html: str) -> List[Dict[str, Any]]:
-        """Извлекает объявления из HTML страницы Cian"""
-        listings = []
+    async def parse_many(self, urls: List[str], concurrency: int = 8) -> List[List[Dict[str, Any]]]:
+        """Параллельно парсит несколько страниц поиска.
         
-        # Парсим HTML с BeautifulSoup
-        soup = BeautifulSoup(html, 'lxml')
+        Одновременно выполняется не больше concurrency запросов; результаты
+        возвращаются в порядке urls. Собственный асинхронный клиент по окончании закрывается.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
         
-        # Ищем все карточки объявлений по ссылкам на /sale/flat/ или /rent/flat/
-        listing_links = soup.find_all('a', href=re.compile(r'/(?:sale|rent)/flat/\d+/'))
+        async def bounded_fetch(url: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self.aparse_search_page(url)
+        
+        try:
+            return list(await asyncio.gather(*(bounded_fetch(url) for url in urls)))
+        finally:
+            await self.aclose()
+    
+    def _search_response_ok(self, url: str, response: httpx.Response) -> bool:
+        """Проверяет статус ответа со страницей поиска до чтения тела"""
+        if response.status_code == 429:
+            logger.warning(f"Rate limited (429) for {url}")
+            return False
+        
+        response.raise_for_status()
+        return True
+    
+    def _listings_from_search_tree(self, url: str, response: httpx.Response, tree) -> List[Dict[str, Any]]:
+        """Разбирает дерево страницы поиска"""
+        logger.info(f"Response: {response.status_code}, {response.num_bytes_downloaded} bytes")
+        
+        listings = self._extract_listings_from_tree(tree)
+        
+        if listings:
+            logger.info(f"Found {len(listings)} listings")
+            # Пустые страницы (блокировка, конец выдачи) не кэшируем - их стоит запросить снова
+            if len(self._search_page_cache) >= SEARCH_PAGE_CACHE_SIZE:
+                self._search_page_cache.pop(next(iter(self._search_page_cache)))
+            self._search_page_cache[_normalize_url(url)] = listings
+        else:
+            logger.warning(f"No listings found on {url}")
+        
+        return listings
+    
+    def _extract_listings_from_tree(self, tree) -> List[Dict[str, Any]]:
+        """Извлекает объявления из разобранного lxml-дерева страницы Cian"""
+        listings = []
         
         # Собираем уникальные ID
         seen_ids = set()
+        # Контексты cianId в JSON страницы - собираются одним проходом при первой неудаче с карточкой
+        json_contexts = None
         
-        for link in listing_links:
+        # Ищем все карточки объявлений по ссылкам на /sale/flat/ или /rent/flat/
+        for link in _LISTING_LINKS_XPATH(tree):
             # Извлекаем ID из URL
             href = link.get('href', '')
-            id_match = re.search(r'/(?:sale|rent)/flat/(\d+)/', href)
+            id_match = _LISTING_HREF_RE.search(href)
             if not id_match:
                 continue
             
@@ -191,28 +557,22 @@ class CianParser:
                 continue
             seen_ids.add(cian_id)
             
-            # Ищем родительский контейнер карточки
-            # Поднимаемся вверх по DOM чтобы найти контейнер с классом содержащим "container"
-            card = link
-            for _ in range(10):  # Увеличил до 10 уровней
-                parent = card.parent
-                if parent and parent.name:
-                    # Проверяем есть ли у родителя класс с "container" или "card"
-                    parent_class = parent.get('class', [])
-                    if any('container' in str(cls).lower() or 'card' in str(cls).lower() 
-                           for cls in parent_class):
-                        card = parent
-                        break
-                    card = parent
-                else:
-                    break
+            # Ищем родительский контейнер карточки - ближайший предок (не выше 10 уровней)
+            # с классом, содержащим "container" или "card"; если такого нет - самый дальний из них
+            card = _first(_CARD_CONTAINER_XPATH, link)
+            if card is None:
+                card = _first(_CARD_FALLBACK_XPATH, link)
+            if card is None:
+                card = link
             
             listing = self._extract_listing_from_card(card, cian_id, href)
             if listing:
                 listings.append(listing)
             else:
                 # Если не нашли в карточке, пробуем из JSON
-                json_listing = self._extract_listing_by_id(html, cian_id)
+                if json_contexts is None:
+                    json_contexts = _script_cian_id_contexts(tree)
+                json_listing = self._extract_listing_by_id(json_contexts.get(cian_id, ''), cian_id)
                 if json_listing:
                     json_listing['url'] = href if href.startswith('http') else f"https://spb.cian.ru{href}"
                     listings.append(json_listing)
@@ -236,22 +596,28 @@ class CianParser:
                 listing['deal_type'] = 'rent'
             
             # Получаем весь текст карточки для поиска паттернов
-            card_text = card.get_text(' ', strip=True)
+            card_text = _node_text(card, ' ')
+            
+            # Без цены и площади карточка все равно будет отброшена (см. валидацию в конце) -
+            # рекламу и подборки отсекаем до регулярных выражений
+            has_price = '₽' in card_text
+            if not has_price and 'м²' not in card_text:
+                return None
+            card_text_lower = card_text.lower()
             
             # Цена - ищем паттерн с рублями в любом месте карточки
-            price_match = re.search(r'(\d[\d\s]*\d)\s*₽', card_text.replace('\xa0', ' ').replace('&nbsp;', ' '))
+            price_match = has_price and _CARD_PRICE_RE.search(card_text.translate(_NBSP_TO_SPACE).replace('&nbsp;', ' '))
             if price_match:
-                price_str = price_match.group(1).replace(' ', '').replace('\xa0', '')
+                price_str = price_match.group(1).translate(_DROP_DIGIT_SPACES)
                 try:
                     listing['price'] = int(price_str)
                 except ValueError:
                     pass
             
             # Ищем ссылку с описанием - она содержит "комн", "м²", "этаж"
-            desc_links = card.find_all('a', href=True)
             desc_text = ''
-            for link in desc_links:
-                link_text = link.get_text(' ', strip=True)
+            for link in _CARD_LINKS_XPATH(card):
+                link_text = _node_text(link, ' ')
                 if 'комн' in link_text or 'м²' in link_text or 'этаж' in link_text:
                     desc_text = link_text
                     break
@@ -259,48 +625,46 @@ class CianParser:
             # Если не нашли в ссылке, ищем в любом тексте карточки
             if not desc_text:
                 # Ищем паттерн типа "2-комн. кв. · 77,50 м² · 4/15 этаж"
-                desc_match = re.search(r'(\d+-комн[^·]*·[^·]*м²[^·]*·[^·]*этаж)', card_text)
+                desc_match = _CARD_DESC_RE.search(card_text)
                 if desc_match:
                     desc_text = desc_match.group(1)
             
             # Парсим описание
             if desc_text:
                 # Комнаты
-                rooms_match = re.search(r'(\d+)-комн', desc_text)
+                rooms_match = _CARD_ROOMS_RE.search(desc_text)
                 if rooms_match:
                     listing['rooms'] = int(rooms_match.group(1))
                 elif 'Студия' in desc_text or 'студия' in desc_text:
                     listing['rooms'] = 0
                 
                 # Площадь - ищем число перед м² (может быть с запятой или точкой)
-                area_match = re.search(r'(\d+[,.]?\d*)\s*м²', desc_text.replace(',', '.'))
+                area_match = _CARD_AREA_RE.search(desc_text.replace(',', '.'))
                 if area_match:
-                    area_str = area_match.group(1).replace(',', '.')
                     try:
-                        area = float(area_str)
+                        area = float(area_match.group(1))
                         if 10 <= area <= 500:  # Реалистичные значения
                             listing['area_total'] = area
                     except ValueError:
                         pass
                 
                 # Этаж / этажность
-                floor_match = re.search(r'(\d+)/(\d+)\s*этаж', desc_text)
+                floor_match = _CARD_FLOOR_RE.search(desc_text)
                 if floor_match:
                     listing['floor'] = int(floor_match.group(1))
                     listing['floors_total'] = int(floor_match.group(2))
             
             # Метро - ищем элемент с data-name="Underground"
-            metro_elem = card.find(attrs={'data-name': 'Underground'})
-            if metro_elem:
-                metro_text = metro_elem.get_text(' ', strip=True)
+            metro_elem = _first(_UNDERGROUND_XPATH, card)
+            if metro_elem is not None:
+                metro_text = _node_text(metro_elem, ' ')
                 
                 # Название станции - ищем span с классом содержащим "name"
-                name_spans = metro_elem.find_all('span')
                 metro_name = None
-                for span in name_spans:
-                    span_text = span.get_text(strip=True)
+                for span in metro_elem.iterdescendants('span'):
+                    span_text = span.text_content().strip()
                     # Название метро обычно короткое, без цифр в начале, и не пустое
-                    if span_text and len(span_text) < 50 and not re.match(r'^\d+', span_text) and span_text != '6':
+                    if span_text and len(span_text) < 50 and not _LEADING_DIGITS_RE.match(span_text) and span_text != '6':
                         # Проверяем что это не время (цифра)
                         if not span_text.isdigit():
                             metro_name = span_text
@@ -309,83 +673,83 @@ class CianParser:
                 # Если не нашли в span, ищем в тексте элемента
                 if not metro_name:
                     # Ищем текст который выглядит как название станции (заглавные буквы, русские)
-                    metro_match = re.search(r'([А-ЯЁ][А-Яа-яЁё\s\-]+)', metro_text)
+                    metro_match = _METRO_NAME_RE.search(metro_text)
                     if metro_match:
                         metro_name = metro_match.group(1).strip()
                         # Убираем время если попало
-                        metro_name = re.sub(r'\s+\d+\s*$', '', metro_name)
+                        metro_name = _TRAILING_NUMBER_RE.sub('', metro_name)
                 
-                if metro_name and self._is_valid_metro_name(metro_name):
+                if metro_name and _is_valid_metro_name(metro_name):
                     listing['metro'] = metro_name
                 
                 # Время до метро - ищем в GeoTravelTime
-                time_elem = metro_elem.find(attrs={'data-name': 'GeoTravelTime'})
-                if time_elem:
-                    time_text = time_elem.get_text(strip=True)
-                    time_match = re.search(r'(\d+)', time_text)
+                time_elem = _first(_TRAVEL_TIME_XPATH, metro_elem)
+                if time_elem is not None:
+                    time_text = time_elem.text_content().strip()
+                    time_match = _DIGITS_RE.search(time_text)
                     if time_match:
                         listing['metro_time'] = int(time_match.group(1))
                     
                     # Тип (пешком/транспорт) - по data-name внутри
-                    if time_elem.find(attrs={'data-name': 'walk'}):
+                    if _WALK_ICON_XPATH(time_elem):
                         listing['metro_transport'] = 'walk'
-                    elif time_elem.find(attrs={'data-name': re.compile(r'transport|bus')}):
+                    elif _TRANSPORT_ICON_XPATH(time_elem):
                         listing['metro_transport'] = 'transport'
                 else:
                     # Если нет GeoTravelTime, ищем время в тексте metro_elem
-                    time_match = re.search(r'(\d+)\s*(?:мин|мин\.|минут)', metro_text, re.IGNORECASE)
+                    time_match = _METRO_MINUTES_RE.search(metro_text)
                     if time_match:
                         listing['metro_time'] = int(time_match.group(1))
                         # Определяем тип по иконке или тексту
-                        if 'walk' in str(metro_elem) or 'пешком' in metro_text.lower():
+                        metro_markup = etree.tostring(metro_elem, encoding='unicode', with_tail=False)
+                        if 'walk' in metro_markup or 'пешком' in metro_text.lower():
                             listing['metro_transport'] = 'walk'
-                        elif 'transport' in str(metro_elem) or 'автобус' in metro_text.lower() or 'bus' in str(metro_elem):
+                        elif 'transport' in metro_markup or 'автобус' in metro_text.lower() or 'bus' in metro_markup:
                             listing['metro_transport'] = 'transport'
             
             # Fallback: ищем метро по тексту в карточке (если не нашли через data-name)
             if not listing.get('metro'):
-                # Ищем паттерн типа "метро Название" или просто название станции (заглавные буквы)
-                metro_patterns = [
-                    r'метро\s+([А-ЯЁ][А-Яа-яЁё\s\-]+)',
-                    r'([А-ЯЁ][А-Яа-яЁё\s\-]+)\s+метро',
-                    r'([А-ЯЁ][А-Яа-яЁё]{3,20})\s+\d+\s*мин',  # Название + время
-                ]
-                for pattern in metro_patterns:
-                    metro_match = re.search(pattern, card_text, re.IGNORECASE)
+                # Ищем паттерн типа "метро Название" или просто название станции (заглавные буквы);
+                # шаблон без своего ключевого слова в тексте не запускаем
+                for keyword, pattern in _CARD_METRO_RES:
+                    if keyword not in card_text_lower:
+                        continue
+                    metro_match = pattern.search(card_text)
                     if metro_match:
                         metro_name = metro_match.group(1).strip()
                         # Фильтруем - название должно быть валидным
-                        if self._is_valid_metro_name(metro_name):
+                        if _is_valid_metro_name(metro_name):
                             listing['metro'] = metro_name
                             # Пытаемся найти время рядом
-                            time_match = re.search(r'(\d+)\s*(?:мин|мин\.)', card_text[metro_match.end():metro_match.end()+50])
+                            time_match = _NEARBY_MINUTES_RE.search(card_text[metro_match.end():metro_match.end()+50])
                             if time_match:
                                 listing['metro_time'] = int(time_match.group(1))
                             break
             
             # Адрес - ищем span с классом содержащим "address"
             # Обычно это короткий текст после метро
-            address_spans = card.find_all('span')
-            for span in address_spans:
-                span_class = span.get('class', [])
-                if any('address' in str(cls).lower() for cls in span_class):
-                    addr_text = span.get_text(strip=True)
-                    # Адрес должен быть коротким и содержать улицу/проспект
-                    if len(addr_text) < 200 and (addr_text and not addr_text.startswith('Квартиры')):
-                        listing['address'] = addr_text
-                        break
-            
-            # Логируем что нашли для отладки
-            if listing.get('price'):
-                logger.debug(f"Listing {cian_id}: price={listing.get('price')}, rooms={listing.get('rooms')}, "
-                           f"area={listing.get('area_total')}, floor={listing.get('floor')}/{listing.get('floors_total')}, "
-                           f"metro={listing.get('metro')}, metro_time={listing.get('metro_time')}, address={listing.get('address')}")
-            
-            # Дополнительное логирование если метро не найдено но должно быть
-            if not listing.get('metro') and listing.get('price'):
-                # Проверяем есть ли упоминание метро в тексте карточки
-                if 'метро' in card_text.lower() or 'подземн' in card_text.lower():
-                    logger.debug(f"Metro mentioned but not extracted for listing {cian_id}. Card text snippet: {card_text[:200]}")
+            for span in _ADDRESS_SPANS_XPATH(card):
+                addr_text = span.text_content().strip()
+                # Адрес должен быть коротким и содержать улицу/проспект
+                if len(addr_text) < 200 and (addr_text and not addr_text.startswith('Квартиры')):
+                    listing['address'] = addr_text
+                    break
+            
+            # Логируем что нашли для отладки - сообщения собираются, только если DEBUG включен
+            if listing.get('price') and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Listing %s: price=%s, rooms=%s, area=%s, floor=%s/%s, metro=%s, metro_time=%s, address=%s",
+                    cian_id, listing.get('price'), listing.get('rooms'), listing.get('area_total'),
+                    listing.get('floor'), listing.get('floors_total'), listing.get('metro'),
+                    listing.get('metro_time'), listing.get('address'),
+                )
+                
+                # Дополнительное логирование если метро не найдено но должно быть
+                if not listing.get('metro') and ('метро' in card_text_lower or 'подземн' in card_text_lower):
+                    logger.debug(
+                        "Metro mentioned but not extracted for listing %s. Card text snippet: %s",
+                        cian_id, card_text[:200],
+                    )
             
             # Валидация - нужна хотя бы цена или площадь
             if listing.get('price') or listing.get('area_total'):
@@ -394,22 +758,19 @@ class CianParser:
             return None
             
         except Exception as e:
-            logger.debug(f"Error extracting card {cian_id}: {e}")
-            import traceback
-            logger.debug(traceback.format_exc())
+            logger.debug("Error extracting card %s: %s", cian_id, e, exc_info=True)
             return None
     
     def _extract_from_json(self, html: str) -> List[Dict[str, Any]]:
         """Fallback: извлекает данные из JSON в HTML"""
         listings = []
         
-        cian_ids = re.findall(r'"cianId":(\d+)', html)
-        unique_ids = list(dict.fromkeys(cian_ids))
+        contexts = _cian_id_contexts(html)
         
-        logger.info(f"Fallback: found {len(unique_ids)} cianIds in JSON")
+        logger.info(f"Fallback: found {len(contexts)} cianIds in JSON")
         
-        for cian_id in unique_ids:
-            listing = self._extract_listing_by_id(html, cian_id)
+        for cian_id, context in contexts.items():
+            listing = self._extract_listing_by_id(context, cian_id)
             if listing:
                 listings.append(listing)
         
@@ -431,58 +792,33 @@ class CianParser:
                 'published': product.get('published', True),
             }
         except Exception as e:
-            logger.debug(f"Error parsing product: {e}")
+            logger.debug("Error parsing product: %s", e)
             return None
     
-    def _extract_listing_by_id(self, html: str, cian_id: str) -> Optional[Dict[str, Any]]:
-        """Извлекает данные объявления по его ID из HTML (JSON fallback)"""
+    def _extract_listing_by_id(self, context: str, cian_id: str) -> Optional[Dict[str, Any]]:
+        """Извлекает данные объявления из JSON-контекста после его cianId (JSON fallback)"""
         try:
             listing = {'cian_id': int(cian_id)}
             
-            # Ищем более широкий контекст - до 2000 символов после cianId
-            pattern = rf'"cianId":{cian_id}(.{{0,2000}})'
-            match = re.search(pattern, html, re.DOTALL)
-            
-            if match:
-                context = match.group(1)
-                
-                # Извлекаем цену
-                price_match = re.search(r'"price":(\d+)', context)
-                if price_match:
-                    listing['price'] = int(price_match.group(1))
-                
-                # Извлекаем тип объекта
-                obj_type_match = re.search(r'"objectType":"([^"]+)"', context)
-                if obj_type_match:
-                    listing['object_type'] = obj_type_match.group(1)
-                
-                # Извлекаем тип сделки
-                deal_match = re.search(r'"dealType":"([^"]+)"', context)
-                if deal_match:
-                    listing['deal_type'] = deal_match.group(1)
-                
-                # Комнаты
-                rooms_match = re.search(r'"roomsCount":(\d+)', context)
-                if rooms_match:
-                    listing['rooms'] = int(rooms_match.group(1))
-                
-                # Этаж
-                floor_match = re.search(r'"floorNumber":(\d+)', context)
-                if floor_match:
-                    listing['floor'] = int(floor_match.group(1))
-                
-                # Этажность
-                floors_match = re.search(r'"floorsCount":(\d+)', context)
-                if floors_match:
-                    listing['floors_total'] = int(floors_match.group(1))
+            # Все поля за один проход по контексту; берется первое вхождение каждого
+            found = set()
+            for field_match in _LISTING_JSON_FIELDS_RE.finditer(context):
+                key, kind = _LISTING_JSON_FIELDS[field_match.group(1)]
+                string_value, number_value = field_match.group(2), field_match.group(3)
+                if key in found or (string_value if kind is str else number_value) is None:
+                    continue
+                found.add(key)
                 
-                # Площадь (может быть totalArea, livingArea, или area)
-                area_match = re.search(r'"(?:totalArea|area|livingArea)":([0-9.]+)', context)
-                if area_match:
+                if kind is str:
+                    listing[key] = string_value
+                elif kind is int:
+                    listing[key] = int(number_value.partition('.')[0])
+                else:
+                    # Площадь (может быть totalArea, livingArea, или area)
                     try:
-                        area = float(area_match.group(1))
+                        area = float(number_value)
                         if 10 <= area <= 500:
-                            listing['area_total'] = area
+                            listing[key] = area
                     except ValueError:
                         pass
             
@@ -494,48 +830,9 @@ class CianParser:
             return listing if listing.get('price') or listing.get('rooms') else None
             
         except Exception as e:
-            logger.debug(f"Error extracting listing {cian_id}: {e}")
+            logger.debug("Error extracting listing %s: %s", cian_id, e)
             return None
     
-    def _is_valid_metro_name(self, name: str) -> bool:
-        """Проверяет что название метро валидное"""
-        if not name or len(name) < 2:
-            return False
-        
-        # Список невалидных значений
-        invalid_patterns = [
-            'минут', 'минуты', 'минута', 'мин', 'мин.',
-            'рядом', 'до', 'от', 'пешком', 'на', 'транспорт',
-            'автобус', 'bus', 'walk', 'transport',
-            'метро', 'подземн', 'станция', 'станции',
-            'и', 'или', 'к', 'от', 'до',
-        ]
-        
-        name_lower = name.lower().strip()
-        
-        # Проверяем что это не одно из невалидных слов
-        if name_lower in invalid_patterns:
-            return False
-        
-        # Проверяем что название не начинается с невалидных слов
-        for pattern in invalid_patterns:
-            if name_lower.startswith(pattern + ' ') or name_lower.startswith(pattern + ','):
-                return False
-        
-        # Проверяем что название содержит хотя бы одну русскую букву
-        if not re.search(r'[А-Яа-яЁё]', name):
-            return False
-        
-        # Проверяем что название не состоит только из цифр и знаков
-        if re.match(r'^[\d\s\-\.,]+$', name):
-            return False
-        
-        # Проверяем длину (названия станций обычно 3-30 символов)
-        if len(name.strip()) < 3 or len(name.strip()) > 30:
-            return False
-        
-        return True
-    
     def _get_random_delay(self) -> float:
         """Возвращает случайную задержку"""
         base = settings.request_delay
@@ -547,301 +844,328 @@ class CianParser:
         try:
             logger.info(f"Parsing listing details from: {url}")
             response = self.client.get(url)
+            return self._listing_details_from_response(url, response)
             
-            if response.status_code == 429:
-                logger.warning(f"Rate limited (429) for {url}")
-                return None
-            
-            response.raise_for_status()
-            html = response.text
-            
-            soup = BeautifulSoup(html, 'lxml')
-            listing_data = {}
-            
-            # Извлекаем ID из URL
-            id_match = re.search(r'/(?:sale|rent)/flat/(\d+)/', url)
-            if id_match:
-                listing_data['cian_id'] = int(id_match.group(1))
-            
-            # Ищем JSON данные в HTML (initialState или другие JSON структуры)
-            # Cian часто хранит данные в скриптах
-            scripts = soup.find_all('script', type='application/json')
-            for script in scripts:
-                try:
-                    data = json.loads(script.string)
-                    # Рекурсивно ищем данные объявления
-                    self._extract_from_json_data(data, listing_data)
-                except (json.JSONDecodeError, AttributeError):
-                    continue
-            
-            # Также ищем в тексте скриптов
-            all_scripts = soup.find_all('script')
-            for script in all_scripts:
-                if script.string:
-                    # Ищем паттерны типа "cianId":123
-                    cian_id_match = re.search(r'"cianId":(\d+)', script.string)
-                    if cian_id_match:
-                        # Ищем данные вокруг этого ID
-                        context = script.string
-                        self._extract_listing_data_from_text(context, listing_data)
-            
-            # Парсим HTML элементы
-            # Цена
-            price_elem = soup.find(string=re.compile(r'\d+.*₽'))
-            if price_elem:
-                price_text = price_elem.strip()
-                price_match = re.search(r'(\d[\d\s]*\d)\s*₽', price_text.replace('\xa0', ' '))
-                if price_match:
-                    price_str = price_match.group(1).replace(' ', '')
-                    listing_data['price'] = int(price_str)
-            
-            # Заголовок
-            title_elem = soup.find('h1') or soup.find('title')
-            if title_elem:
-                listing_data['title'] = title_elem.get_text(strip=True)
-            
-            # Описание
-            desc_elem = soup.find('div', class_=re.compile(r'description')) or soup.find('p', class_=re.compile(r'description'))
-            if desc_elem:
-                listing_data['description'] = desc_elem.get_text(strip=True)
-            
-            # Характеристики из таблицы или списка
-            # Ищем элементы с характеристиками
-            features = soup.find_all(['div', 'span', 'p'], string=re.compile(r'(комнат|м²|этаж|год|ремонт)'))
-            for feature in features:
-                text = feature.get_text(strip=True)
-                
-                # Комнаты
-                if 'комнат' in text.lower():
-                    rooms_match = re.search(r'(\d+)\s*комнат', text, re.IGNORECASE)
-                    if rooms_match:
-                        listing_data['rooms'] = int(rooms_match.group(1))
-                
-                # Площадь
-                if 'м²' in text or 'м2' in text:
-                    area_match = re.search(r'(\d+[,.]?\d*)\s*м[²2]', text)
-                    if area_match:
-                        area_str = area_match.group(1).replace(',', '.')
-                        try:
-                            area = float(area_str)
-                            if 'общая' in text.lower() or 'total' in text.lower():
-                                listing_data['area_total'] = area
-                            elif 'жилая' in text.lower() or 'living' in text.lower():
-                                listing_data['area_living'] = area
-                            elif 'кухн' in text.lower() or 'kitchen' in text.lower():
-                                listing_data['area_kitchen'] = area
-                            elif not listing_data.get('area_total'):
-                                listing_data['area_total'] = area
-                        except ValueError:
-                            pass
-                
-                # Этаж
-                if 'этаж' in text.lower():
-                    floor_match = re.search(r'(\d+)/(\d+)', text)
-                    if floor_match:
-                        listing_data['floor'] = int(floor_match.group(1))
-                        listing_data['floors_total'] = int(floor_match.group(2))
-            
-            # Адрес
-            address_elem = soup.find(['div', 'span'], class_=re.compile(r'address')) or soup.find('meta', property='og:street-address')
-            if address_elem:
-                addr_text = address_elem.get('content') or address_elem.get_text(strip=True)
-                if addr_text and len(addr_text) < 500:
-                    listing_data['address'] = addr_text
-            
-            # Метро
-            metro_elem = soup.find(string=re.compile(r'метро|подземн'))
-            if metro_elem:
-                parent = metro_elem.parent
-                metro_text = parent.get_text(strip=True) if parent else metro_elem.strip()
-                metro_match = re.search(r'([А-Яа-яЁё\s\-]+)', metro_text)
-                if metro_match:
-                    listing_data['metro'] = metro_match.group(1).strip()
-            
-            logger.info(f"Extracted data for listing {listing_data.get('cian_id')}: {list(listing_data.keys())}")
-            return listing_data if listing_data.get('cian_id') else None
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP error parsing {url}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error parsing listing details {url}: {e}")
+            logger.debug("Traceback for %s", url, exc_info=True)
+            return None
+    
+    async def aparse_listing_details(self, url: str) -> Optional[Dict[str, Any]]:
+        """Асинхронный вариант parse_listing_details"""
+        try:
+            logger.info(f"Parsing listing details from: {url}")
+            response = await self.aclient.get(url, headers=self.headers)
+            return self._listing_details_from_response(url, response)
             
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP error parsing {url}: {e}")
             return None
         except Exception as e:
             logger.error(f"Error parsing listing details {url}: {e}")
-            import traceback
-            logger.debug(traceback.format_exc())
+            logger.debug("Traceback for %s", url, exc_info=True)
             return None
     
-    def _extract_from_json_data(self, data: Any, listing_data: Dict[str, Any], path: str = ""):
-        """Рекурсивно извлекает данные из JSON структуры"""
-        if isinstance(data, dict):
-            for key, value in data.items():
-                new_path = f"{path}.{key}" if path else key
-                
+    def _listing_details_from_response(self, url: str, response: httpx.Response) -> Optional[Dict[str, Any]]:
+        """Разбирает ответ с детальной страницей объявления"""
+        if response.status_code == 429:
+            logger.warning(f"Rate limited (429) for {url}")
+            return None
+        
+        response.raise_for_status()
+        # Кодировка из заголовков, иначе UTF-8 (Cian отдает UTF-8) - без угадывания
+        # кодировки по содержимому, которое делает response.text
+        html = response.content.decode(response.charset_encoding or 'utf-8', errors='replace')
+        
+        soup = BeautifulSoup(html, 'lxml')
+        listing_data = {}
+        
+        # Извлекаем ID из URL
+        id_match = _LISTING_HREF_RE.search(url)
+        if id_match:
+            listing_data['cian_id'] = int(id_match.group(1))
+        
+        # Ищем JSON данные в HTML (initialState или другие JSON структуры)
+        # Cian часто хранит данные в скриптах
+        scripts = soup.find_all('script', type='application/json')
+        for script in scripts:
+            # Скрипт без единого известного ключа ничего не даст - не декодируем и не обходим его
+            script_text = script.string
+            if not script_text or not any(marker in script_text for marker in _JSON_FIELD_MARKERS):
+                continue
+            try:
+                data = orjson.loads(script_text)
+                # Ищем данные объявления по всей структуре
+                self._extract_from_json_data(data, listing_data)
+            except (orjson.JSONDecodeError, AttributeError):
+                continue
+        
+        # Также ищем в тексте скриптов - только пока JSON и предыдущие скрипты заполнили
+        # не все поля: поиск по тексту уже заполненные поля не перезаписывает
+        if not _detail_text_fields_filled(listing_data):
+            for script in soup.find_all('script'):
+                if script.string:
+                    # Ищем паттерны типа "cianId":123
+                    cian_id_match = _CIAN_ID_RE.search(script.string)
+                    if cian_id_match:
+                        # Ищем данные вокруг этого ID
+                        context = script.string
+                        if self._extract_listing_data_from_text(context, listing_data):
+                            break
+        
+        # Парсим HTML элементы
+        # Цена
+        price_elem = soup.find(string=_DETAIL_PRICE_TEXT_RE)
+        if price_elem:
+            price_text = price_elem.strip()
+            price_match = _CARD_PRICE_RE.search(price_text.translate(_NBSP_TO_SPACE))
+            if price_match:
+                price_str = price_match.group(1).translate(_DROP_DIGIT_SPACES)
+                listing_data['price'] = int(price_str)
+        
+        # Заголовок
+        title_elem = soup.find('h1') or soup.find('title')
+        if title_elem:
+            listing_data['title'] = title_elem.get_text(strip=True)
+        
+        # Описание
+        desc_elem = soup.find('div', class_=_DESCRIPTION_CLASS_RE) or soup.find('p', class_=_DESCRIPTION_CLASS_RE)
+        if desc_elem:
+            listing_data['description'] = desc_elem.get_text(strip=True)
+        
+        # Характеристики из таблицы или списка
+        # Ищем элементы с характеристиками
+        features = soup.find_all(['div', 'span', 'p'], string=_FEATURE_TEXT_RE)
+        for feature in features:
+            text = feature.get_text(strip=True)
+            
+            # Комнаты
+            if 'комнат' in text.lower():
+                rooms_match = _FEATURE_ROOMS_RE.search(text)
+                if rooms_match:
+                    listing_data['rooms'] = int(rooms_match.group(1))
+            
+            # Площадь
+            if 'м²' in text or 'м2' in text:
+                area_match = _FEATURE_AREA_RE.search(text)
+                if area_match:
+                    area_str = area_match.group(1).replace(',', '.')
+                    try:
+                        area = float(area_str)
+                        if 'общая' in text.lower() or 'total' in text.lower():
+                            listing_data['area_total'] = area
+                        elif 'жилая' in text.lower() or 'living' in text.lower():
+                            listing_data['area_living'] = area
+                        elif 'кухн' in text.lower() or 'kitchen' in text.lower():
+                            listing_data['area_kitchen'] = area
+                        elif not listing_data.get('area_total'):
+                            listing_data['area_total'] = area
+                    except ValueError:
+                        pass
+            
+            # Этаж
+            if 'этаж' in text.lower():
+                floor_match = _FEATURE_FLOOR_RE.search(text)
+                if floor_match:
+                    listing_data['floor'] = int(floor_match.group(1))
+                    listing_data['floors_total'] = int(floor_match.group(2))
+        
+        # Адрес
+        address_elem = soup.find(['div', 'span'], class_=_ADDRESS_CLASS_RE) or soup.find('meta', property='og:street-address')
+        if address_elem:
+            addr_text = address_elem.get('content') or address_elem.get_text(strip=True)
+            if addr_text and len(addr_text) < 500:
+                listing_data['address'] = addr_text
+        
+        # Метро
+        metro_elem = soup.find(string=_METRO_TEXT_RE)
+        if metro_elem:
+            parent = metro_elem.parent
+            metro_text = parent.get_text(strip=True) if parent else metro_elem.strip()
+            metro_match = _DETAIL_METRO_NAME_RE.search(metro_text)
+            if metro_match:
+                listing_data['metro'] = metro_match.group(1).strip()
+        
+        logger.info(f"Extracted data for listing {listing_data.get('cian_id')}: {list(listing_data.keys())}")
+        return listing_data if listing_data.get('cian_id') else None
+    
+    def _extract_from_json_data(self, data: Any, listing_data: Dict[str, Any]):
+        """Извлекает данные из JSON структуры.
+        
+        Обход в глубину без рекурсии: стек итераторов по вложенным dict/list.
+        Порядок обхода прежний (значение ключа разбирается до следующих ключей),
+        поэтому при повторах поля побеждает то же вхождение, что и раньше.
+        """
+        if not isinstance(data, (dict, list)):
+            return
+        
+        stack = [_json_children(data)]
+        while stack:
+            for key, value in stack[-1]:
                 # Ищем известные поля
-                if key in ['cianId', 'id'] and isinstance(value, (int, str)):
-                    listing_data['cian_id'] = int(value)
-                elif key == 'price' and isinstance(value, (int, float)):
-                    listing_data['price'] = int(value)
-                elif key == 'roomsCount' and isinstance(value, int):
-                    listing_data['rooms'] = value
-                elif key == 'floorNumber' and isinstance(value, int):
-                    listing_data['floor'] = value
-                elif key == 'floorsCount' and isinstance(value, int):
-                    listing_data['floors_total'] = value
-                elif key in ['totalArea', 'area', 'livingArea'] and isinstance(value, (int, float)):
+                field = _JSON_FIELD_DISPATCH.get(key)
+                if field is not None:
+                    target, types, convert = field
+                    if isinstance(value, types):
+                        listing_data[target] = convert(value) if convert else value
+                elif key in _JSON_AREA_KEYS and isinstance(value, (int, float)):
                     if not listing_data.get('area_total') or key == 'totalArea':
                         listing_data['area_total'] = float(value)
-                elif key == 'kitchenArea' and isinstance(value, (int, float)):
-                    listing_data['area_kitchen'] = float(value)
-                elif key == 'address' and isinstance(value, str):
-                    listing_data['address'] = value
-                elif key == 'description' and isinstance(value, str):
-                    listing_data['description'] = value
-                elif key == 'title' and isinstance(value, str):
-                    listing_data['title'] = value
                 
-                # Рекурсивно обрабатываем вложенные структуры
+                # Вложенную структуру разбираем сразу, затем продолжаем текущую
                 if isinstance(value, (dict, list)):
-                    self._extract_from_json_data(value, listing_data, new_path)
-        
-        elif isinstance(data, list):
-            for i, item in enumerate(data):
-                self._extract_from_json_data(item, listing_data, f"{path}[{i}]")
+                    stack.append(_json_children(value))
+                    break
+            else:
+                stack.pop()
     
-    def _extract_listing_data_from_text(self, text: str, listing_data: Dict[str, Any]):
-        """Извлекает данные из текста (JSON строки в скриптах)"""
-        # Цена
-        if not listing_data.get('price'):
-            price_match = re.search(r'"price":(\d+)', text)
-            if price_match:
-                listing_data['price'] = int(price_match.group(1))
-        
-        # Комнаты
-        if not listing_data.get('rooms'):
-            rooms_match = re.search(r'"roomsCount":(\d+)', text)
-            if rooms_match:
-                listing_data['rooms'] = int(rooms_match.group(1))
-        
-        # Этаж
-        if not listing_data.get('floor'):
-            floor_match = re.search(r'"floorNumber":(\d+)', text)
-            if floor_match:
-                listing_data['floor'] = int(floor_match.group(1))
-        
-        # Этажность
-        if not listing_data.get('floors_total'):
-            floors_match = re.search(r'"floorsCount":(\d+)', text)
-            if floors_match:
-                listing_data['floors_total'] = int(floors_match.group(1))
-        
-        # Площадь
-        if not listing_data.get('area_total'):
-            area_match = re.search(r'"(?:totalArea|area)":([0-9.]+)', text)
-            if area_match:
+    def _extract_listing_data_from_text(self, text: str, listing_data: Dict[str, Any]) -> bool:
+        """Извлекает данные из текста (JSON строки в скриптах).
+        
+        Возвращает True, когда заполнены все поля, которые можно найти в тексте.
+        """
+        # Для каждого поля берется первое вхождение, уже заполненные поля не перезаписываются;
+        # когда заполнено все, остаток текста (JSON бывает в сотни КБ) не просматривается
+        for match in _DETAIL_FIELDS_RE.finditer(text):
+            key = _DETAIL_FIELD_KEYS[match.group(1)]
+            if listing_data.get(key):
+                continue
+            value = match.group(2)
+            if key == 'area_total':
                 try:
-                    listing_data['area_total'] = float(area_match.group(1))
+                    listing_data[key] = float(value)
                 except ValueError:
-                    pass
+                    continue
+            else:
+                listing_data[key] = int(value.partition('.')[0])
+            if _detail_text_fields_filled(listing_data):
+                return True
+        return False
     
-    def save_listing(self, listing_data: Dict[str, Any]) -> Optional[Listing]:
-        """Сохраняет объявление в базу данных"""
+    def save_listings_bulk(self, listings_data: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Сохраняет объявления страницы одним INSERT ... ON CONFLICT (avito_id) DO UPDATE.
+        
+        Новые объявления затем сопоставляются с объектами недвижимости, все - одним коммитом.
+        Возвращает число новых, обновленных и несохраненных объявлений.
+        """
+        counts = {"new": 0, "updated": 0, "errors": 0}
+        parsed_at = datetime.utcnow()
+        
+        # Один cianId - одна строка: ON CONFLICT не может обновить строку дважды за запрос
+        rows = {}
+        for listing_data in listings_data:
+            row = self._listing_row(listing_data, parsed_at)
+            if row is None:
+                counts["errors"] += 1
+                continue
+            rows[row['avito_id']] = row
+        if not rows:
+            return counts
+        
         try:
-            cian_id = listing_data.get('cian_id')
-            if not cian_id:
-                return None
-            
-            # Генерируем заголовок из данных
-            title = self._generate_title(listing_data)
-            
-            # Ищем существующее объявление
-            existing = self.db.query(Listing).filter(
-                Listing.avito_id == cian_id  # Используем avito_id для совместимости
-            ).first()
-            
-            if existing:
-                # Обновляем существующее
-                existing.price = listing_data.get('price', existing.price)
-                existing.rooms = listing_data.get('rooms', existing.rooms)
-                existing.floor = listing_data.get('floor', existing.floor)
-                existing.floors_total = listing_data.get('floors_total', existing.floors_total)
-                existing.area_total = listing_data.get('area_total', existing.area_total)
-                
-                # Адрес - только если короткий (реальный адрес)
-                new_address = listing_data.get('address')
-                if new_address and len(new_address) < 200:
-                    existing.address = new_address
-                
-                # Метро - обновляем только если есть валидное значение
-                if 'metro' in listing_data:
-                    metro_value = listing_data.get('metro')
-                    if metro_value and self._is_valid_metro_name(metro_value):
-                        existing.metro = metro_value
-                    elif metro_value is None:
-                        # Если явно None, не трогаем существующее значение
-                        pass
-                
-                if 'metro_time' in listing_data:
-                    existing.metro_time = listing_data.get('metro_time')
-                if 'metro_transport' in listing_data:
-                    existing.metro_transport = listing_data.get('metro_transport')
-                
-                # Title - ограничиваем длину
-                if title:
-                    existing.title = title[:490] if len(title) > 490 else title
-                
-                existing.parsed_at = datetime.utcnow()
-                self.db.commit()
-                return existing
-            else:
-                # Подготавливаем данные с ограничением длины
-                address = listing_data.get('address')
-                if address and len(address) > 200:
-                    address = None  # Скорее всего это не адрес
-                
-                safe_title = title[:490] if title and len(title) > 490 else title
-                
-                # Валидируем метро перед сохранением
-                metro_value = listing_data.get('metro')
-                if metro_value and not self._is_valid_metro_name(metro_value):
-                    metro_value = None
-                
-                # Создаём новое
-                listing = Listing(
-                    avito_id=cian_id,
-                    url=listing_data.get('url', ''),
-                    title=safe_title,
-                    price=listing_data.get('price'),
-                    address=address,
-                    rooms=listing_data.get('rooms'),
-                    area_total=listing_data.get('area_total'),
-                    floor=listing_data.get('floor'),
-                    floors_total=listing_data.get('floors_total'),
-                    metro=metro_value,
-                    metro_time=listing_data.get('metro_time'),
-                    metro_transport=listing_data.get('metro_transport'),
-                    description=listing_data.get('description'),
-                    city=listing_data.get('city'),
-                    deal_type=listing_data.get('deal_type'),
-                    property_type=listing_data.get('property_type'),
-                    is_active=True,
-                    parsed_at=datetime.utcnow(),
-                )
-                
-                self.db.add(listing)
-                self.db.commit()
-                self.db.refresh(listing)
-                
-                # Пытаемся сопоставить с недвижимостью
+            saved = self.db.execute(self._listings_upsert(list(rows.values()))).all()
+            self.db.commit()
+        except Exception as e:
+            # Одна плохая строка не должна терять всю страницу - сохраняем по одной,
+            # каждую в своем SAVEPOINT, и считаем ошибками только непрошедшие
+            logger.error(f"Error saving {len(rows)} listings in one batch, saving one by one: {e}")
+            self.db.rollback()
+            saved = []
+            for row in rows.values():
+                try:
+                    with self.db.begin_nested():
+                        saved.extend(self.db.execute(self._listings_upsert([row])).all())
+                except Exception as row_error:
+                    logger.error(f"Error saving listing {row['avito_id']}: {row_error}")
+                    counts["errors"] += 1
+            self.db.commit()
+        
+        # xmax = 0 только у строк, вставленных этим запросом
+        new_ids = [row.id for row in saved if row.inserted]
+        counts["new"] = len(new_ids)
+        counts["updated"] = len(saved) - len(new_ids)
+        
+        if new_ids:
+            self._match_new_listings(new_ids)
+        return counts
+    
+    @staticmethod
+    def _listings_upsert(rows: List[Dict[str, Any]]):
+        """INSERT ... ON CONFLICT (avito_id) DO UPDATE по правилам _UPSERT_KEEP_EXISTING"""
+        stmt = pg_insert(Listing).values(rows)
+        columns = Listing.__table__.c
+        return stmt.on_conflict_do_update(
+            index_elements=[columns.avito_id],
+            set_={
+                **{
+                    name: func.coalesce(stmt.excluded[name], columns[name])
+                    for name in _UPSERT_KEEP_EXISTING
+                },
+                'title': stmt.excluded.title,
+                'parsed_at': stmt.excluded.parsed_at,
+                # onupdate колонки в ON CONFLICT не применяется
+                'updated_at': func.now(),
+            },
+        ).returning(columns.id, literal_column("xmax = 0").label("inserted"))
+    
+    def _listing_row(self, listing_data: Dict[str, Any], parsed_at: datetime) -> Optional[Dict[str, Any]]:
+        """
+        Строка для вставки в listings (None без cianId).
+        Длинный "адрес" и невалидное метро заменяются на None, заголовок - не длиннее 490 символов.
+        """
+        cian_id = listing_data.get('cian_id')
+        if not cian_id:
+            return None
+        
+        # Длинный "адрес" - скорее всего не адрес
+        address = listing_data.get('address')
+        if address and len(address) >= 200:
+            address = None
+        
+        metro_value = listing_data.get('metro')
+        if metro_value and not _is_valid_metro_name(metro_value):
+            metro_value = None
+        
+        # Core-вставка идет мимо @validates модели - нормализуем типы здесь
+        deal_type = listing_data.get('deal_type')
+        property_type = listing_data.get('property_type')
+        
+        return {
+            'avito_id': cian_id,
+            'url': listing_data.get('url', ''),
+            'title': self._generate_title(listing_data)[:490],
+            'price': listing_data.get('price'),
+            'address': address,
+            'rooms': listing_data.get('rooms'),
+            'area_total': listing_data.get('area_total'),
+            'floor': listing_data.get('floor'),
+            'floors_total': listing_data.get('floors_total'),
+            'metro': metro_value,
+            'metro_time': listing_data.get('metro_time'),
+            'metro_transport': listing_data.get('metro_transport'),
+            'description': listing_data.get('description'),
+            'city': listing_data.get('city'),
+            'deal_type': DEAL_TYPE_SLUG_TO_NAME.get(deal_type, deal_type),
+            'property_type': PROPERTY_TYPE_SLUG_TO_NAME.get(property_type, property_type),
+            'is_active': True,
+            'parsed_at': parsed_at,
+        }
+    
+    def _match_new_listings(self, listing_ids: List[int]):
+        """Сопоставляет только что вставленные объявления с объектами недвижимости"""
+        try:
+            new_listings = self.db.scalars(select(Listing).where(Listing.id.in_(listing_ids))).all()
+            for listing in new_listings:
                 property_obj = self.property_matcher.find_or_create_property(listing, save_match_score=True)
                 if property_obj:
                     listing.property_id = property_obj.id
-                    self.db.commit()
-                
-                return listing
-                
+            self.db.commit()
         except Exception as e:
-            logger.error(f"Error saving listing {listing_data.get('cian_id')}: {e}")
+            logger.error(f"Error matching {len(listing_ids)} new listings: {e}")
             self.db.rollback()
-            return None
     
     def _generate_title(self, listing_data: Dict[str, Any]) -> str:
         """Генерирует заголовок из данных объявления"""
@@ -887,6 +1211,11 @@ class CianParser:
             "rate_limited": False
         }
         
+        # Русские названия одинаковы для всех объявлений запуска - вычисляем один раз
+        city_name = self.CITY_NAMES.get(city, city)
+        deal_type_name = self.DEAL_TYPE_NAMES.get(deal_type, deal_type)
+        property_type_name = self.PROPERTY_TYPE_NAMES.get(category, category)
+        
         for page in range(1, max_pages + 1):
             # Задержка перед запросом (кроме первой страницы)
             if page > 1:
@@ -904,32 +1233,30 @@ class CianParser:
                 results["rate_limited"] = True
                 break
             
-            results["total_found"] += len(listings)
+            # Объявления, уже полученные с предыдущих страниц (выдача сдвинулась или
+            # повторилась последняя страница), не сохраняем повторно. Отбрасываем их
+            # после проверки на пустоту: страница из одних повторов - не блокировка
+            seen_ids = self._seen_cian_ids
+            listings = [item for item in listings if item['cian_id'] not in seen_ids]
+            seen_ids.update(item['cian_id'] for item in listings)
             results["pages_parsed"] = page
+            if not listings:
+                logger.info(f"Page {page} has only listings from previous pages")
+                continue
+            
+            results["total_found"] += len(listings)
             
             for listing_data in listings:
                 # Добавляем метаданные
-                # Преобразуем slug города в полное название
-                listing_data['city'] = self.CITY_NAMES.get(city, city)
-                # Преобразуем тип сделки в русское название
-                listing_data['deal_type'] = self.DEAL_TYPE_NAMES.get(deal_type, deal_type)
-                # Преобразуем тип недвижимости в русское название
-                listing_data['property_type'] = self.PROPERTY_TYPE_NAMES.get(category, category)
-                
-                # Проверяем существует ли
-                existing = self.db.query(Listing).filter(
-                    Listing.avito_id == listing_data.get('cian_id')
-                ).first()
-                
-                saved = self.save_listing(listing_data)
-                
-                if saved:
-                    if existing:
-                        results["updated_listings"] += 1
-                    else:
-                        results["new_listings"] += 1
-                else:
-                    results["errors"] += 1
+                listing_data['city'] = city_name
+                listing_data['deal_type'] = deal_type_name
+                listing_data['property_type'] = property_type_name
+            
+            # Вся страница сохраняется одним запросом; новые и обновленные различает сам upsert
+            counts = self.save_listings_bulk(listings)
+            results["new_listings"] += counts["new"]
+            results["updated_listings"] += counts["updated"]
+            results["errors"] += counts["errors"]
         
         logger.info(f"Parsing completed: {results}")
         return results
@@ -0,0 +1,24 @@
+"""
+Keyset-пагинация: непрозрачный курсор с позицией (метка времени, id) последней записи
+"""
+import json
+import base64
+from datetime import datetime
+from typing import Tuple
+
+from fastapi import HTTPException
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    """Кодирует позицию (ts, id) в непрозрачный курсор"""
+    payload = json.dumps({"ts": ts.isoformat(), "id": row_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Декодирует курсор в (ts, id)"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["ts"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
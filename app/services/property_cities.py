@@ -0,0 +1,51 @@
+"""
+Список городов объектов недвижимости из materialized view property_cities (миграция 019).
+Представление обновляется после операций, меняющих объекты массово или их города
+"""
+import logging
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.services.cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+
+def get_property_cities(db: Session) -> List[str]:
+    """Города, в которых есть объекты недвижимости, по алфавиту"""
+    rows = db.execute(text("SELECT city FROM property_cities ORDER BY city"))
+    return [row[0] for row in rows if row[0]]
+
+
+def refresh_property_cities(db: Session):
+    """Пересчитывает представление, не блокируя чтение списка городов"""
+    db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY property_cities"))
+    db.commit()
+
+
+def refresh_property_cities_safely(db: Session):
+    """
+    Пересчитывает представление после уже закоммиченного изменения.
+    Ошибка только логируется: запись сохранена, и ответ на нее не должен падать.
+    Кэш вызывающий сбрасывает до обновления; список городов сбрасываем еще раз после -
+    его могли закэшировать из старого представления, пока оно пересчитывалось
+    """
+    try:
+        refresh_property_cities(db)
+    except Exception as e:
+        logger.error(f"Property cities refresh error: {e}")
+        db.rollback()
+        return
+    response_cache.invalidate("properties:cities")
+
+
+def refresh_property_cities_task():
+    """Фоновое обновление (BackgroundTasks) в собственной сессии: сессия запроса к этому времени закрыта"""
+    db = SessionLocal()
+    try:
+        refresh_property_cities_safely(db)
+    finally:
+        db.close()
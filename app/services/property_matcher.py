@@ -1,6 +1,7 @@
 import re
 import logging
-from typing import Optional, Dict, Tuple, List
+from functools import lru_cache
+from typing import Optional, Dict, Tuple, List, FrozenSet
 from dataclasses import dataclass
 
 from sqlalchemy.orm import Session
@@ -12,6 +13,39 @@ from app.models import Property, Listing, MatchConfig
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Кэш активной конфигурации метчинга: (id, updated_at) -> (weights, strict_attrs, threshold)
+_config_cache: Dict[tuple, Tuple[Dict[str, float], FrozenSet[str], float]] = {}
+
+# Замены при нормализации адреса; применяются по очереди, порядок важен -
+# по результату сравниваются улицы уже сохраненных объектов
+_ADDRESS_REPLACEMENTS = tuple((re.compile(pattern), replacement) for pattern, replacement in (
+    (r'\bул\.?\s*', ''),
+    (r'\bулица\s*', ''),
+    (r'\bпр\.?\s*', ''),
+    (r'\bпроспект\s*', ''),
+    (r'\bпер\.?\s*', ''),
+    (r'\bпереулок\s*', ''),
+    (r'\bд\.?\s*', ''),
+    (r'\bдом\s*', ''),
+    (r'\bкв\.?\s*', ''),
+    (r'\bквартира\s*', ''),
+    (r'\bкорп\.?\s*', 'к'),
+    (r'\bкорпус\s*', 'к'),
+    (r'\bстр\.?\s*', 'с'),
+    (r'\bстроение\s*', 'с'),
+    (r'\s+', ' '),
+))
+_HOUSE_NUMBER_RE = re.compile(r'[,\s]+(\d+[а-яА-Яa-zA-Z]?(?:/\d+)?(?:\s*к\s*\d+)?(?:\s*с\s*\d+)?)\s*$')
+
+
+@lru_cache(maxsize=8192)
+def _normalize_address_text(address: str) -> str:
+    """Нормализует адрес для сравнения (адреса повторяются между объявлениями - результат кэшируется)"""
+    normalized = address.lower()
+    for pattern, replacement in _ADDRESS_REPLACEMENTS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized.strip()
+
 
 @dataclass
 class MatchResult:
@@ -28,19 +62,36 @@ class PropertyMatcher:
     Использует модель сходства с весами атрибутов.
     """
     
+    weights: Dict[str, float]
+    strict_attrs: FrozenSet[str]
+    threshold: float
+    
     def __init__(self, db: Session):
         self.db = db
+        # Кандидаты по ключу (город, тип недвижимости); включается на время rematch_all_listings
+        self._candidates_cache: Optional[Dict[Tuple[Optional[str], Optional[str]], List[Property]]] = None
         self._load_config()
     
     def _load_config(self):
         """Загружает конфигурацию метчинга из БД или использует дефолтные значения из config"""
-        # Пытаемся загрузить активную конфигурацию из БД
-        config = self.db.query(MatchConfig).filter(MatchConfig.is_active == True).first()
-        
-        if config:
-            self.weights = config.weights
-            self.strict_attrs = config.strict_attributes
-            self.threshold = float(config.threshold)
+        # Пытаемся загрузить активную конфигурацию из БД.
+        # Сначала читаем только id и updated_at - полную строку с JSON
+        # подгружаем лишь если конфигурация изменилась с прошлого раза
+        active = self.db.query(MatchConfig.id, MatchConfig.updated_at).filter(
+            MatchConfig.is_active == True
+        ).first()
+        
+        if active:
+            cache_key = (active.id, active.updated_at)
+            if cache_key not in _config_cache:
+                config = self.db.query(MatchConfig).filter(MatchConfig.id == active.id).first()
+                _config_cache.clear()
+                _config_cache[cache_key] = (
+                    config.weights,
+                    frozenset(config.strict_attributes),
+                    config.threshold,
+                )
+            self.weights, self.strict_attrs, self.threshold = _config_cache[cache_key]
         else:
             # Используем дефолтные значения из config
             self.weights = settings.property_match_weights
@@ -51,31 +102,7 @@ class PropertyMatcher:
         """Нормализует адрес для сравнения"""
         if not address:
             return ""
-        
-        normalized = address.lower()
-        
-        replacements = [
-            (r'\bул\.?\s*', ''),
-            (r'\bулица\s*', ''),
-            (r'\bпр\.?\s*', ''),
-            (r'\bпроспект\s*', ''),
-            (r'\bпер\.?\s*', ''),
-            (r'\bпереулок\s*', ''),
-            (r'\bд\.?\s*', ''),
-            (r'\bдом\s*', ''),
-            (r'\bкв\.?\s*', ''),
-            (r'\bквартира\s*', ''),
-            (r'\bкорп\.?\s*', 'к'),
-            (r'\bкорпус\s*', 'к'),
-            (r'\bстр\.?\s*', 'с'),
-            (r'\bстроение\s*', 'с'),
-            (r'\s+', ' '),
-        ]
-        
-        for pattern, replacement in replacements:
-            normalized = re.sub(pattern, replacement, normalized)
-        
-        return normalized.strip()
+        return _normalize_address_text(address)
     
     def _extract_address_parts(self, listing: Listing) -> dict:
         """Извлекает компоненты адреса из объявления"""
@@ -95,7 +122,7 @@ class PropertyMatcher:
         if listing.address:
             address = listing.address
             
-            house_match = re.search(r'[,\s]+(\d+[а-яА-Яa-zA-Z]?(?:/\d+)?(?:\s*к\s*\d+)?(?:\s*с\s*\d+)?)\s*$', address)
+            house_match = _HOUSE_NUMBER_RE.search(address)
             if house_match:
                 parts['house_number'] = house_match.group(1).strip().lower()
                 address = address[:house_match.start()].strip()
@@ -149,12 +176,16 @@ class PropertyMatcher:
         
         return (val1 == val2, 1.0 if val1 == val2 else 0.0)
     
-    def _calculate_similarity(self, listing: Listing, property: Property) -> MatchResult:
+    def _calculate_similarity(
+        self, listing: Listing, property: Property, address_parts: Optional[dict] = None
+    ) -> MatchResult:
         """
         Вычисляет сходство между объявлением и объектом недвижимости.
         Возвращает MatchResult с процентом сходства и деталями.
+        address_parts - уже разобранный адрес объявления (при переборе кандидатов).
         """
-        address_parts = self._extract_address_parts(listing)
+        if address_parts is None:
+            address_parts = self._extract_address_parts(listing)
         
         # Словарь для хранения результатов сравнения атрибутов
         matched_attrs = {}
@@ -220,6 +251,44 @@ class PropertyMatcher:
             strict_violations=strict_violations
         )
     
+    def _get_candidates(self, city: Optional[str], property_type: Optional[str]) -> List[Property]:
+        """Потенциальные совпадения по городу и типу недвижимости"""
+        key = (city, property_type)
+        if self._candidates_cache is not None and key in self._candidates_cache:
+            return self._candidates_cache[key]
+        
+        # Сессия без autoflush: еще не вставленные объекты (rematch создает их без flush)
+        # запрос не увидит, и под новый ключ будет создан дубликат - сбрасываем их сначала
+        if self.db.new:
+            self.db.flush()
+        
+        query = self.db.query(Property)
+        
+        # Фильтруем по городу (если есть)
+        if city:
+            query = query.filter(Property.city.ilike(f"%{city}%"))
+        
+        # Фильтруем по типу недвижимости (если есть)
+        if property_type:
+            query = query.filter(Property.property_type == property_type)
+        
+        candidates = query.all()
+        if self._candidates_cache is not None:
+            self._candidates_cache[key] = candidates
+        return candidates
+    
+    def _remember_candidate(self, property_obj: Property):
+        """Добавляет созданный объект в уже загруженные списки кандидатов, под фильтр которых он попадает"""
+        if self._candidates_cache is None:
+            return
+        property_city = (property_obj.city or '').lower()
+        for (city, property_type), candidates in self._candidates_cache.items():
+            if city and city not in property_city:
+                continue
+            if property_type and property_obj.property_type != property_type:
+                continue
+            candidates.append(property_obj)
+    
     def find_best_match(self, listing: Listing) -> Optional[MatchResult]:
         """
         Находит лучший подходящий объект недвижимости для объявления.
@@ -231,20 +300,8 @@ class PropertyMatcher:
         
         address_parts = self._extract_address_parts(listing)
         
-        # Строим базовый запрос для поиска потенциальных совпадений
-        query = self.db.query(Property)
-        
-        # Фильтруем по городу (если есть)
-        if address_parts.get('city') or listing.city:
-            city = (address_parts.get('city') or listing.city).lower()
-            query = query.filter(Property.city.ilike(f"%{city}%"))
-        
-        # Фильтруем по типу недвижимости (если есть)
-        if listing.property_type:
-            query = query.filter(Property.property_type == listing.property_type)
-        
-        # Получаем все потенциальные совпадения
-        candidates = query.all()
+        city = address_parts.get('city') or listing.city
+        candidates = self._get_candidates(city.lower() if city else None, listing.property_type)
         
         if not candidates:
             logger.debug(f"No property candidates found for listing {listing.avito_id}")
@@ -255,7 +312,7 @@ class PropertyMatcher:
         best_score = 0.0
         
         for candidate in candidates:
-            match_result = self._calculate_similarity(listing, candidate)
+            match_result = self._calculate_similarity(listing, candidate, address_parts)
             
             if match_result.similarity_score > best_score:
                 best_score = match_result.similarity_score
@@ -275,26 +332,17 @@ class PropertyMatcher:
         )
         return None
     
-    def find_or_create_property(self, listing: Listing, save_match_score: bool = True) -> Optional[Property]:
+    def _create_property(self, listing: Listing, flush: bool = True) -> Property:
         """
-        Находит существующий или создает новый объект недвижимости для объявления.
-        Сохраняет процент сходства в listing.match_score.
-        Возвращает Property или None.
+        Создает объект недвижимости по данным объявления.
+        flush=False - объект не записывается сразу, а вставляется вместе
+        с остальными при следующем flush сессии (id у него до этого нет).
         """
-        # Ищем лучшее совпадение
-        match_result = self.find_best_match(listing)
-        
-        if match_result:
-            # Нашли подходящий объект
-            if save_match_score:
-                listing.match_score = match_result.similarity_score
-            return match_result.property
-        
-        # Не нашли подходящий объект - создаем новый
         address_parts = self._extract_address_parts(listing)
         
         new_property = Property(
-            city=address_parts.get('city') or listing.city,
+            # Исходное название: в address_parts город приведен к нижнему регистру для сравнения
+            city=listing.city,
             district=address_parts.get('district') or listing.district,
             street=address_parts.get('street'),
             house_number=address_parts.get('house_number'),
@@ -309,12 +357,34 @@ class PropertyMatcher:
         )
         
         self.db.add(new_property)
-        self.db.flush()
+        if flush:
+            self.db.flush()
+        self._remember_candidate(new_property)
+        
+        logger.debug(f"Created new property {new_property.id} for listing {listing.avito_id}")
+        return new_property
+    
+    def find_or_create_property(self, listing: Listing, save_match_score: bool = True) -> Optional[Property]:
+        """
+        Находит существующий или создает новый объект недвижимости для объявления.
+        Сохраняет процент сходства в listing.match_score.
+        Возвращает Property или None.
+        """
+        # Ищем лучшее совпадение
+        match_result = self.find_best_match(listing)
+        
+        if match_result:
+            # Нашли подходящий объект
+            if save_match_score:
+                listing.match_score = match_result.similarity_score
+            return match_result.property
+        
+        # Не нашли подходящий объект - создаем новый
+        new_property = self._create_property(listing)
         
         if save_match_score:
             listing.match_score = 100.0  # Новый объект = 100% сходство
         
-        logger.debug(f"Created new property {new_property.id} for listing {listing.avito_id}")
         return new_property
     
     def rematch_all_listings(self) -> dict:
@@ -330,32 +400,55 @@ class PropertyMatcher:
             'low_similarity': 0  # Совпадения с низким процентом сходства
         }
         
-        listings = self.db.query(Listing).all()
+        # Читаем объявления потоково (server-side cursor), не загружая всю таблицу в память
+        listings = self.db.query(Listing).yield_per(500)
         
-        for listing in listings:
-            results['processed'] += 1
-            
-            try:
-                property_obj = self.find_or_create_property(listing, save_match_score=True)
+        # Объявления не изменяются в цикле: результат копится как (id, объект, сходство)
+        # и записывается одним bulk UPDATE в конце
+        assignments = []
+        
+        # Кандидаты загружаются один раз на пару (город, тип), а не запросом на каждое объявление
+        self._candidates_cache = {}
+        try:
+            for listing in listings:
+                results['processed'] += 1
                 
-                if property_obj:
-                    old_property_id = listing.property_id
-                    listing.property_id = property_obj.id
+                try:
+                    match_result = self.find_best_match(listing)
+                    if match_result:
+                        property_obj = match_result.property
+                        match_score = match_result.similarity_score
+                    else:
+                        # Новые объекты не сбрасываются в базу по одному: сессия вставит их
+                        # пачкой - перед запросом кандидатов по новому ключу (_get_candidates) или в конце
+                        property_obj = self._create_property(listing, flush=False)
+                        match_score = 100.0  # Новый объект = 100% сходство
                     
                     # Проверяем процент сходства
-                    if listing.match_score and listing.match_score < self.threshold:
+                    if match_score < self.threshold:
                         results['low_similarity'] += 1
                     
-                    if old_property_id == property_obj.id:
+                    if property_obj.id is not None and listing.property_id == property_obj.id:
                         results['matched'] += 1
+                        if listing.match_score == match_score:
+                            continue  # Ничего не изменилось - строку не обновляем
                     else:
                         results['created'] += 1
-                else:
-                    results['failed'] += 1
                     
-            except Exception as e:
-                logger.error(f"Error rematching listing {listing.id}: {e}")
-                results['failed'] += 1
+                    assignments.append((listing.id, property_obj, match_score))
+                        
+                except Exception as e:
+                    logger.error(f"Error rematching listing {listing.id}: {e}")
+                    results['failed'] += 1
+        finally:
+            self._candidates_cache = None
+        
+        # Вставляем оставшиеся новые объекты - после этого id есть у всех
+        self.db.flush()
+        self.db.bulk_update_mappings(Listing, [
+            {'id': listing_id, 'property_id': property_obj.id, 'match_score': match_score}
+            for listing_id, property_obj, match_score in assignments
+        ])
         
         self.db.commit()
         return results
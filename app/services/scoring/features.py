@@ -165,13 +165,13 @@ class FeatureExtractor:
             1 if listing.metro else 0,
             1 if listing.address else 0,
             1 if listing.description else 0,
-            1 if listing.images else 0,
+            1 if listing.image_urls else 0,
         ])
         
         return {
             "data_completeness": filled_fields / 8.0,
             "has_description": 1 if listing.description else 0,
-            "has_images": 1 if listing.images else 0,
+            "has_images": 1 if listing.image_urls else 0,
             "description_length": len(listing.description) if listing.description else 0,
         }
     
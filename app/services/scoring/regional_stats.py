@@ -65,19 +65,23 @@ class RegionalStatistics:
         if property_type:
             query = query.filter(Listing.property_type == property_type)
         
-        listings = query.filter(
+        # Нужны только три колонки - читаем их потоково, без загрузки ORM-объектов
+        rows = query.with_entities(Listing.price, Listing.area_total, Listing.rooms).filter(
             Listing.price.isnot(None),
             Listing.area_total.isnot(None),
             Listing.area_total > 0
-        ).all()
-        
-        if not listings:
-            return self._get_default_statistics()
+        ).yield_per(1000)
         
         prices_per_m2 = []
-        for listing in listings:
-            if listing.price and listing.area_total:
-                prices_per_m2.append(listing.price / listing.area_total)
+        areas = []
+        rooms_distribution = {}
+        for price, area_total, rooms in rows:
+            if price and area_total:
+                prices_per_m2.append(price / area_total)
+            if area_total:
+                areas.append(area_total)
+            if rooms is not None:
+                rooms_distribution[rooms] = rooms_distribution.get(rooms, 0) + 1
         
         if not prices_per_m2:
             return self._get_default_statistics()
@@ -99,14 +103,8 @@ class RegionalStatistics:
             "90": prices_per_m2[int(n * 0.9)],
         }
         
-        areas = [l.area_total for l in listings if l.area_total]
         mean_area = sum(areas) / len(areas) if areas else 0
         
-        rooms_distribution = {}
-        for listing in listings:
-            if listing.rooms is not None:
-                rooms_distribution[listing.rooms] = rooms_distribution.get(listing.rooms, 0) + 1
-        
         return {
             "price_per_m2": {
                 "mean": mean_price,